@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+
+
+def build_daily_cube(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Pre-aggregate the plays per day, hour, song and platform.
+
+    df has to be a compact history (categorical names) sorted by endTime, or
+    the plays of a ChunkedHistory, summed per day and platform, whose rows
+    count playCount plays each and have no names. Their cube has hour 0 in
+    every row, the hours come from period_totals instead.
+    Returns the cube and the song table. The cube has one row per
+    (day, hour, song, platform) with the playCount, msPlayed and skipCount of
+    those plays, sorted by day so periods can be cut out with time_slice on
+    "day". Songs, artists, platforms and devices are integer codes, -1 where
+    the name is missing (podcasts, or platform for simple exports). The song
+    table maps song codes to their artistName and trackName and the artist
+    code.
+    """
+    if "artistName" in df.columns:
+        artist = df["artistName"].cat.codes.to_numpy().astype(np.int32)
+        track = df["trackName"].cat.codes.to_numpy().astype(np.int64)
+        artist_dtype, track_dtype = df["artistName"].dtype, df["trackName"].dtype
+    else:
+        artist = np.full(df.shape[0], -1, dtype=np.int32)
+        track = np.full(df.shape[0], -1, dtype=np.int64)
+        artist_dtype = track_dtype = pd.CategoricalDtype([])
+
+    # A song is an (artist, track) pair, the same track name can belong to
+    # several artists
+    nrof_tracks = len(track_dtype.categories)
+    valid = (artist >= 0) & (track >= 0)
+    song = np.full(df.shape[0], -1, dtype=np.int32)
+    codes, song_keys = pd.factorize(
+        artist[valid].astype(np.int64) * nrof_tracks + track[valid], sort=True
+    )
+    song[valid] = codes
+
+    song_artist = (song_keys // nrof_tracks).astype(np.int32)
+    songs = pd.DataFrame(
+        {
+            "artistName": pd.Categorical.from_codes(song_artist, dtype=artist_dtype),
+            "trackName": pd.Categorical.from_codes(
+                song_keys % nrof_tracks, dtype=track_dtype
+            ),
+            "artist": song_artist,
+        }
+    )
+
+    if "platform" in df.columns:
+        platform = df["platform"].cat.codes.to_numpy().astype(np.int16)
+    else:
+        platform = np.full(df.shape[0], -1, dtype=np.int16)
+    if "device" in df.columns:
+        device = df["device"].cat.codes.to_numpy().astype(np.int8)
+    else:
+        device = np.full(df.shape[0], -1, dtype=np.int8)
+    if "skipCount" in df.columns:
+        skipped = df["skipCount"].to_numpy().astype(np.int32)
+    elif "skipped" in df.columns:
+        skipped = df["skipped"].to_numpy().astype(np.int32)
+    else:
+        skipped = np.zeros(df.shape[0], dtype=np.int32)
+    if "playCount" in df.columns:
+        play_count = df["playCount"].to_numpy().astype(np.int32)
+    else:
+        play_count = np.ones(df.shape[0], dtype=np.int32)
+
+    plays = pd.DataFrame(
+        {
+            "day": df["endTime"].dt.floor("D"),
+            "hour": df["endTime"].dt.hour.astype(np.int8),
+            "song": song,
+            "artist": artist,
+            "platform": platform,
+            "device": device,
+            "playCount": play_count,
+            "msPlayed": df["msPlayed"].astype(np.int64),
+            "skipCount": skipped,
+        }
+    )
+    # artist follows from song and device from platform, they are only grouped
+    # on to keep them in the cube
+    cube = (
+        plays.groupby(
+            ["day", "hour", "song", "artist", "platform", "device"], sort=True
+        )
+        .sum()
+        .reset_index()
+    )
+    return cube, songs
+
+
+def daily_series(values: pd.Series) -> pd.Series:
+    """Fill in zeros for the days missing between the first and last day of values."""
+    return values.asfreq("D", fill_value=0)
+
+
+def daily_matrix(
+    daily: pd.DataFrame, column: str, keys, value: str = "playCount"
+) -> tuple[pd.DatetimeIndex, np.ndarray]:
+    """Sum value per day for each of keys in one pass over the daily cube.
+
+    Returns the days from the first to the last day any of the keys was
+    played and a (days x keys) matrix, column i holding the daily sums of
+    the rows where column == keys[i].
+    """
+    keys = pd.Index(keys)
+    selected = daily[daily[column].isin(keys)]
+    if selected.empty:
+        return pd.DatetimeIndex([]), np.zeros((0, len(keys)))
+
+    days = pd.date_range(selected["day"].iloc[0], selected["day"].iloc[-1], freq="D")
+    rows = ((selected["day"] - days[0]) // pd.Timedelta(days=1)).to_numpy()
+    cols = keys.get_indexer(selected[column])
+    matrix = np.bincount(
+        rows * len(keys) + cols,
+        weights=selected[value].to_numpy(),
+        minlength=len(days) * len(keys),
+    ).reshape(len(days), len(keys))
+    return days, matrix
+
+
+def rolling_mean(matrix: np.ndarray, window: int, start=0) -> np.ndarray:
+    """Trailing rolling mean down each column, NaN until the window is full.
+
+    start gives the row each column's series begins at (a number or one per
+    column), the window only counts as full window - 1 rows after it. Uses
+    the difference of two cumulative sums, so the cost does not depend on
+    the window or on the number of columns beyond one pass over matrix.
+    """
+    if matrix.shape[0] == 0:
+        return np.zeros(matrix.shape)
+    cumulative = np.zeros((matrix.shape[0] + 1, matrix.shape[1]))
+    np.cumsum(matrix, axis=0, out=cumulative[1:])
+    means = np.full(matrix.shape, np.nan)
+    means[window - 1 :] = (cumulative[window:] - cumulative[:-window]) / window
+    means[np.arange(matrix.shape[0])[:, None] < np.asarray(start) + window - 1] = np.nan
+    return means
+
+
+def active_spans(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """First and last row with a non zero value in each column of matrix.
+
+    Both are empty for a matrix without rows, nothing was played.
+    """
+    if matrix.shape[0] == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    played = matrix != 0
+    first = played.argmax(axis=0)
+    last = matrix.shape[0] - 1 - played[::-1].argmax(axis=0)
+    return first, last
+
+
+class Ranking:
+    """Play count and ms played per key code, with cached top lists.
+
+    The totals are counted once with bincount. A top-k query selects the k
+    largest with argpartition and only sorts those, and the ordered prefix is
+    kept so any k up to the largest asked for is a slice. Ties are ranked by
+    key code, which follows the name order.
+    """
+
+    measures = ("playCount", "msPlayed")
+
+    def __init__(self, codes: np.ndarray, daily: pd.DataFrame, nrof_keys: int):
+        played = codes >= 0
+        self.totals = {
+            measure: np.bincount(
+                codes[played],
+                weights=daily[measure].to_numpy()[played],
+                minlength=nrof_keys,
+            ).astype(np.int64)
+            for measure in self.measures
+        }
+        # Keys that were not played in the period are never ranked
+        self._played = np.flatnonzero(self.totals["playCount"])
+        self._order = {
+            measure: np.array([], dtype=np.int64) for measure in self.measures
+        }
+
+    def top(self, k: int, by: str = "playCount") -> np.ndarray:
+        """Codes of the k highest ranked keys by measure by, highest first."""
+        if k > len(self._order[by]) and len(self._order[by]) < len(self._played):
+            values = self.totals[by][self._played]
+            k_all = min(k, len(self._played))
+            # Everything tied with the k:th value is a candidate, so the tie
+            # break by code does not depend on the partition
+            kth = np.partition(values, len(values) - k_all)[len(values) - k_all]
+            candidates = self._played[values >= kth]
+            candidate_values = self.totals[by][candidates]
+            self._order[by] = candidates[np.lexsort((candidates, -candidate_values))][
+                :k_all
+            ]
+        return self._order[by][:k]
+
+
+def downsample(x: np.ndarray, y: np.ndarray, max_points: int):
+    """At most max_points points of the line (x, y) keeping its shape.
+
+    The points are split into max_points // 2 buckets of consecutive points
+    and the lowest and highest point of each bucket are kept, in order, so
+    peaks and dips survive no matter how narrow they are. Buckets that are
+    all NaN keep one NaN point, so gaps in the line stay gaps.
+    """
+    y = np.asarray(y, dtype=float)
+    if max_points is None or len(y) <= max_points:
+        return x, y
+
+    edges = np.linspace(0, len(y), max_points // 2 + 1).astype(int)
+    starts = edges[:-1]
+    # A budget below 2 points leaves no buckets
+    if len(starts) == 0:
+        return np.asarray(x)[:0], y[:0]
+    bucket = np.repeat(np.arange(len(starts)), np.diff(edges))
+    valid = ~np.isnan(y)
+    index = np.arange(len(y))
+
+    # The first lowest and first highest point per bucket, in one pass each
+    # with reduceat, NaN never being the lowest or highest
+    lows = np.minimum.reduceat(np.where(valid, y, np.inf), starts)
+    highs = np.maximum.reduceat(np.where(valid, y, -np.inf), starts)
+    low = np.minimum.reduceat(
+        np.where(valid & (y == lows[bucket]), index, len(y)), starts
+    )
+    high = np.minimum.reduceat(
+        np.where(valid & (y == highs[bucket]), index, len(y)), starts
+    )
+
+    # An all NaN bucket keeps its start, the others their lowest and highest
+    # point in order, once when that is the same point
+    all_nan = ~np.logical_or.reduceat(valid, starts)
+    first = np.where(all_nan, starts, np.minimum(low, high))
+    second = np.maximum(low, high)
+    keep = np.stack([first, second], axis=1)
+    keep_mask = np.stack([np.ones(len(starts), bool), ~all_nan & (second != first)], 1)
+    keep = keep[keep_mask]
+    return np.asarray(x)[keep], y[keep]
@@ -0,0 +1,176 @@
+import argparse
+import json
+import resource
+import time
+import traceback
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import wrappedMaker as wm
+
+# Settings
+# Number of users' reports made at the same time, each in its own process
+workers = 4
+
+# Address space limit of each worker in MiB, a user needing more fails with a
+# MemoryError instead of taking down the machine. None leaves it unlimited
+worker_memory_mib = 4096
+
+# Users a worker makes reports for before it is replaced by a fresh process, so
+# memory fragmented by large histories is given back
+users_per_worker = 25
+
+# Name of the summary written next to the pdfs
+summary_file_name = "batch_summary.json"
+
+# Profile every user, writing <user>.trace.json (Chrome trace) next to the pdf and
+# adding the slowest stages to the summary
+profile_users = False
+nrof_hot_spots = 3
+
+
+def limit_memory(memory_mib: int) -> None:
+    """Worker initializer capping the address space of the process."""
+    if memory_mib is not None:
+        limit = memory_mib * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def make_user_report(user_dir: Path, pdf_path: Path, profile: bool = False) -> dict:
+    """Write the report of the history in user_dir to pdf_path.
+
+    Never raises, failures are returned in the result so one user does not
+    stop the batch.
+    """
+    from parser import WrappedMaker
+    from profiling import Profiler, NO_PROFILER
+
+    profiler = Profiler() if profile else NO_PROFILER
+    result = {"user": user_dir.stem, "pdf": str(pdf_path), "rows": None}
+    start = time.perf_counter()
+    try:
+        wrapp = WrappedMaker(
+            start_date=wm.start_date,
+            end_date=wm.end_date,
+            history_src_dir=user_dir,
+            cache_dir=wm.history_cache_dir,
+            font_families=wm.font_families,
+            profiler=profiler,
+        )
+        result["rows"] = wrapp.nrof_plays
+        wrapp.open_pdf(pdf_path)
+        wm.write_report(wrapp)
+        result["status"] = "ok"
+    except Exception as error:
+        result["status"] = "failed"
+        result["error"] = "".join(traceback.format_exception_only(error)).strip()
+    result["seconds"] = round(time.perf_counter() - start, 3)
+
+    if profiler.enabled:
+        profiler.to_chrome_trace(pdf_path.with_suffix(".trace.json"))
+        result["hot_spots"] = [
+            {"name": span["name"], "seconds": round(span["wall"], 3)}
+            for span in profiler.hot_spots(nrof_hot_spots)
+        ]
+    return result
+
+
+def run_batch(
+    root_dir: Path,
+    out_dir: Path,
+    nrof_workers: int = workers,
+    profile: bool = profile_users,
+) -> list:
+    """Make one pdf per user folder or export ZIP in root_dir, named <user>.pdf
+    in out_dir, <user> being the folder name or the ZIP name without .zip.
+
+    Returns one result per user, in the order of the folder names.
+    """
+    user_dirs = sorted(
+        path
+        for path in root_dir.iterdir()
+        if path.is_dir() or path.suffix.lower() == ".zip"
+    )
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=nrof_workers,
+        initializer=limit_memory,
+        initargs=(worker_memory_mib,),
+        max_tasks_per_child=users_per_worker,
+    ) as pool:
+        futures = {
+            pool.submit(
+                make_user_report, user_dir, out_dir / f"{user_dir.stem}.pdf", profile
+            ): user_dir
+            for user_dir in user_dirs
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                # The worker itself died (killed, crashed), not the report
+                result = {
+                    "user": futures[future].stem,
+                    "status": "failed",
+                    "error": repr(error),
+                    "rows": None,
+                    "seconds": None,
+                }
+            print(
+                f"{result['status']:>6} {result['user']}"
+                + (f": {result['error']}" if result["status"] != "ok" else "")
+            )
+            results.append(result)
+
+    return sorted(results, key=lambda result: result["user"])
+
+
+def print_summary(results: list) -> None:
+    print(f"\n{'user':<30} {'status':>6} {'rows':>10} {'seconds':>8}")
+    for result in results:
+        rows = "" if result["rows"] is None else result["rows"]
+        seconds = "" if result["seconds"] is None else f"{result['seconds']:.2f}"
+        print(f"{result['user']:<30} {result['status']:>6} {rows:>10} {seconds:>8}")
+        for spot in result.get("hot_spots", []):
+            print(f"{'':<30} {spot['seconds']:>26.2f} {spot['name']}")
+
+    failed = sum(result["status"] != "ok" for result in results)
+    print(f"{len(results) - failed} reports written, {failed} failed")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Make a Spotify Wrapped pdf for each user folder in a directory"
+    )
+    arg_parser.add_argument(
+        "root_dir",
+        type=Path,
+        help="directory with one export folder or export ZIP per user",
+    )
+    arg_parser.add_argument(
+        "--out",
+        type=Path,
+        default=wm.pdf_target_path,
+        help="directory the <user>.pdf files and the summary are written to",
+    )
+    arg_parser.add_argument(
+        "--workers", type=int, default=workers, help="number of worker processes"
+    )
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=profile_users,
+        help="write a Chrome trace per user and list each user's slowest stages",
+    )
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_batch(args.root_dir, args.out, args.workers, args.profile)
+    print_summary(results)
+    print(f"Batch took {time.perf_counter() - start:.1f}s")
+
+    Path.joinpath(args.out, summary_file_name).write_text(json.dumps(results, indent=2))
+    if any(result["status"] != "ok" for result in results):
+        raise SystemExit(1)
@@ -0,0 +1,364 @@
+import gc
+import json
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from history import (
+    load_history,
+    read_history,
+    find_history_files,
+    compact_history,
+    sort_history,
+    classify_devices,
+    history_cache_path,
+    write_history_cache,
+)
+from parser import WrappedMaker
+from synthetic import write_history
+from wrappedMaker import write_report
+
+# Settings
+# Number of export files to load in each run and the entries written to each file
+file_counts = [10, 25, 50, 100, 200]
+entries_per_file = 2000
+
+# Allowed growth of the per file load time between the smallest and largest run
+# before the scaling is reported as non linear
+max_per_file_growth = 2.0
+
+# Files written for the memory per play measurement
+memory_file_count = 50
+
+# Cold start budget in seconds for importing parser and for wrappedMaker.py --help,
+# the best of import_runs runs is compared
+import_time_target = 1.5
+import_runs = 5
+
+# Reports drawn back to back in one process by the soak test, the resident memory
+# may grow by at most max_soak_growth_mib between the first sample (taken after
+# soak_sample_every reports, once caches are warm) and the end
+soak_reports = 1000
+soak_sample_every = 100
+max_soak_growth_mib = 20
+
+# Plays of the synthetic histories the stages are timed on, and the baselines
+# they are compared with. A stage regresses when it takes more than
+# time_tolerance times its baseline time (plus min_time_difference seconds) or
+# more than memory_tolerance times its baseline peak (plus min_memory_difference MiB)
+stage_plays = [10_000, 100_000, 1_000_000]
+baselines_path = Path(__file__).parent / "benchmark_baselines.json"
+time_tolerance = 1.5
+min_time_difference = 0.05
+memory_tolerance = 1.25
+min_memory_difference = 1.0
+
+# History drawn with and without downsampling of the chart lines: plays over
+# downsample_years years, with downsample_top_lists songs and artists per chart
+downsample_plays = 300_000
+downsample_years = 15
+downsample_top_lists = 20
+chart_point_budget = 8000
+
+
+def write_synthetic_history(
+    directory: Path, nrof_files: int, entries_per_file: int
+) -> None:
+    write_history(
+        directory, nrof_files * entries_per_file, plays_per_file=entries_per_file
+    )
+
+
+def bench_load_scaling() -> bool:
+    print(f"Loading {entries_per_file} entries per file")
+    per_file_times = []
+    for nrof_files in file_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = Path(tmp)
+            write_synthetic_history(directory, nrof_files, entries_per_file)
+
+            start = time.perf_counter()
+            df, _ = load_history(directory)
+            elapsed = time.perf_counter() - start
+
+        per_file_times.append(elapsed / nrof_files)
+        print(
+            f"{nrof_files:>5} files {df.shape[0]:>9} rows "
+            f"{elapsed:8.3f}s {1000 * per_file_times[-1]:8.2f}ms/file"
+        )
+
+    growth = per_file_times[-1] / per_file_times[0]
+    linear = growth <= max_per_file_growth
+    print(
+        f"Per file load time grew {growth:.2f}x from {file_counts[0]} to "
+        f"{file_counts[-1]} files: {'linear' if linear else 'NOT linear'}"
+    )
+    return linear
+
+
+def bench_memory_per_million_plays() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_synthetic_history(directory, memory_file_count, entries_per_file)
+        plain = read_history(find_history_files(directory))
+        compact, _ = load_history(directory)
+
+    for name, df in [("object/int64", plain), ("compact", compact)]:
+        per_million = df.memory_usage(deep=True).sum() / df.shape[0] * 1e6
+        print(f"{name:>12} frame: {per_million / 2**20:8.1f} MiB per million plays")
+
+
+def bench_import_time() -> bool:
+    repo_dir = Path(__file__).parent
+    commands = {
+        "import parser": [
+            sys.executable,
+            "-c",
+            "import sys, parser; assert 'matplotlib' not in sys.modules",
+        ],
+        "wrappedMaker.py --help": [sys.executable, "wrappedMaker.py", "--help"],
+    }
+    fast = True
+    for name, command in commands.items():
+        times = []
+        for _ in range(import_runs):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=repo_dir, check=True, capture_output=True)
+            times.append(time.perf_counter() - start)
+        fast &= min(times) <= import_time_target
+        print(
+            f"{name:>24}: {min(times):6.3f}s "
+            f"({'within' if min(times) <= import_time_target else 'OVER'} "
+            f"{import_time_target}s)"
+        )
+    return fast
+
+
+def resident_memory() -> int:
+    """Current resident set size in bytes, the peak where /proc is missing."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+        return pages * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bench_render_soak() -> bool:
+    print(f"Drawing {soak_reports} reports in one process")
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_synthetic_history(directory, 2, entries_per_file)
+        wrapp = WrappedMaker(history_src_dir=directory, pdf_target_path=directory)
+
+        start = time.perf_counter()
+        first = None
+        for report in range(1, soak_reports + 1):
+            wrapp.open_pdf(directory / "Wrapped.pdf")
+            write_report(wrapp)
+            if report % soak_sample_every == 0:
+                gc.collect()
+                memory = resident_memory()
+                first = memory if first is None else first
+                print(
+                    f"{report:>6} reports {time.perf_counter() - start:8.1f}s "
+                    f"{memory / 2**20:8.1f} MiB resident"
+                )
+
+    growth = (memory - first) / 2**20
+    flat = growth <= max_soak_growth_mib
+    print(
+        f"Resident memory grew {growth:.1f} MiB over {soak_reports} reports: "
+        f"{'flat' if flat else 'NOT flat'}"
+    )
+    return flat
+
+
+class StageTimer:
+    """Wall time, or peak memory traced by tracemalloc (Python and numpy
+    allocations, not Arrow buffers), of each stage run under measure.
+
+    Tracing slows the allocations down by several times, so the times and
+    the memory are measured in separate runs.
+    """
+
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.stages = {}
+
+    def measure(self, name: str, function, *args, **kwargs):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            if self.trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stages[name] = round(peak / 2**20, 2)
+            else:
+                self.stages[name] = round(time.perf_counter() - start, 4)
+
+
+def normalize(df):
+    return classify_devices(sort_history(compact_history(df)))
+
+
+def run_stages(directory: Path, trace_memory: bool = False) -> dict:
+    """Time, or trace the memory of, every stage of the report of directory."""
+    timer = StageTimer(trace_memory)
+    with tempfile.TemporaryDirectory() as tmp:
+        files = find_history_files(directory)
+
+        df = timer.measure("load", read_history, files)
+        df = timer.measure("normalize", normalize, df)
+
+        # The maker reads the normalized history back from its cache
+        cache_dir = Path(tmp) / "cache"
+        write_history_cache(df, history_cache_path(cache_dir, directory, files))
+        del df
+        wrapp = timer.measure(
+            "cache read",
+            WrappedMaker,
+            history_src_dir=directory,
+            pdf_target_path=Path(tmp),
+            cache_dir=cache_dir,
+        )
+
+        # In the order of write_report, the daily cube is built by front_page
+        for page in [
+            "front_page",
+            "top_songs",
+            "top_songs_chart",
+            "top_artists",
+            "top_artists_chart",
+            "song_skip_stats",
+            "least_skipped_top_songs",
+            "play_time_chart",
+            "play_time_per_hour_in_day",
+            "play_time_per_weekday",
+            "device_listening_time",
+            "device_listening_chart",
+        ]:
+            timer.measure(page, getattr(wrapp, page))
+        timer.measure("pdf write", wrapp.write_to_file)
+    return timer.stages
+
+
+def bench_stages(plays_list: list[int], update_baselines: bool = False) -> bool:
+    baselines = {}
+    if baselines_path.exists():
+        baselines = json.loads(baselines_path.read_text())
+
+    regressions = []
+    for plays in plays_list:
+        print(f"Stages on {plays} plays")
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = Path(tmp)
+            write_history(directory, plays)
+            seconds = run_stages(directory)
+            peaks = run_stages(directory, trace_memory=True)
+        stages = {
+            name: {"seconds": seconds[name], "peak_mib": peaks[name]}
+            for name in seconds
+        }
+        baseline = baselines.get(str(plays), {})
+        for name, result in stages.items():
+            line = f"{name:>26} {result['seconds']:9.3f}s {result['peak_mib']:9.1f} MiB"
+            if name in baseline:
+                base = baseline[name]
+                slower = result["seconds"] > (
+                    base["seconds"] * time_tolerance + min_time_difference
+                )
+                larger = result["peak_mib"] > (
+                    base["peak_mib"] * memory_tolerance + min_memory_difference
+                )
+                line += (
+                    f"   baseline {base['seconds']:9.3f}s {base['peak_mib']:9.1f} MiB"
+                )
+                if slower or larger:
+                    line += "  REGRESSION"
+                    regressions.append((plays, name))
+            print(line)
+        if update_baselines:
+            baselines[str(plays)] = stages
+
+    if update_baselines:
+        baselines_path.write_text(json.dumps(baselines, indent=1) + "\n")
+        print(f"Baselines written to {baselines_path}")
+    return not regressions
+
+
+def bench_downsampling() -> None:
+    print(
+        f"Charts of {downsample_plays} plays over {downsample_years} years, "
+        f"{downsample_top_lists} songs and artists"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = Path(tmp)
+        write_history(directory, downsample_plays, days=downsample_years * 365)
+        for budget in [None, chart_point_budget]:
+            wrapp = WrappedMaker(history_src_dir=directory, chart_point_budget=budget)
+            wrapp.open_pdf(directory / "charts.pdf")
+            wrapp.play_time_chart()
+            wrapp.top_songs_chart(downsample_top_lists)
+            wrapp.top_artists_chart(downsample_top_lists)
+            wrapp.device_listening_chart()
+            points = sum(len(y) for page in wrapp.pages for _, y, _ in page.lines)
+
+            start = time.perf_counter()
+            wrapp.write_to_file()
+            elapsed = time.perf_counter() - start
+            size = (directory / "charts.pdf").stat().st_size
+            print(
+                f"{'every day' if budget is None else f'budget {budget}':>14}: "
+                f"{points:>8} points {size / 2**10:9.1f} KiB {elapsed:7.2f}s"
+            )
+
+
+BENCHMARKS = ["startup", "memory", "scaling", "soak", "stages", "downsampling"]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmarks of WrappedMaker")
+    arg_parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        choices=BENCHMARKS,
+        default=BENCHMARKS,
+        help="benchmarks to run, all by default",
+    )
+    arg_parser.add_argument(
+        "--plays",
+        type=int,
+        action="append",
+        help="plays of the histories the stages are timed on, can be given several "
+        f"times (up to 10000000), default {stage_plays}",
+    )
+    arg_parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="store the stage results as the new baselines",
+    )
+    args = arg_parser.parse_args()
+
+    passed = True
+    if "startup" in args.benchmarks:
+        passed &= bench_import_time()
+    if "memory" in args.benchmarks:
+        bench_memory_per_million_plays()
+    if "scaling" in args.benchmarks:
+        passed &= bench_load_scaling()
+    if "soak" in args.benchmarks:
+        passed &= bench_render_soak()
+    if "downsampling" in args.benchmarks:
+        bench_downsampling()
+    if "stages" in args.benchmarks:
+        passed &= bench_stages(args.plays or stage_plays, args.update_baselines)
+    if not passed:
+        raise SystemExit(1)
@@ -0,0 +1,92 @@
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import wrappedMaker as wm
+from sketches import CohortSummary, merge_tree
+
+# Settings
+# Number of users summarized at the same time, and merged at the same time in
+# each level of the merge tree
+workers = 4
+
+# Songs and artists each summary keeps counts for, and the size of the Count-Min
+# sketches estimating the play count of any song or artist
+heavy_hitter_capacity = 1000
+count_min_width = 2**14
+count_min_depth = 4
+
+
+def summarize_user(user_dir: Path) -> CohortSummary:
+    """Summary of the history in user_dir, a folder or export ZIP."""
+    from parser import WrappedMaker
+
+    wrapp = WrappedMaker(
+        start_date=wm.start_date,
+        end_date=wm.end_date,
+        history_src_dir=user_dir,
+        cache_dir=wm.history_cache_dir,
+    )
+    return wrapp.cohort_summary(heavy_hitter_capacity, count_min_width, count_min_depth)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Top lists and listening spread over the users in a directory"
+    )
+    arg_parser.add_argument(
+        "root_dir",
+        type=Path,
+        help="directory with one export folder or export ZIP per user, or with "
+        "the <user>.json summaries written by --summaries when --merge is given",
+    )
+    arg_parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="merge the summaries in root_dir instead of loading the users",
+    )
+    arg_parser.add_argument("--workers", type=int, default=workers)
+    arg_parser.add_argument("--top", type=int, default=10)
+    arg_parser.add_argument(
+        "--summaries",
+        type=Path,
+        help="write each user's summary to <user>.json in this directory",
+    )
+    arg_parser.add_argument(
+        "--out", type=Path, help="write the merged summary to this json file"
+    )
+    args = arg_parser.parse_args()
+
+    if args.merge:
+        summaries = [
+            CohortSummary.from_json(path)
+            for path in sorted(args.root_dir.glob("*.json"))
+        ]
+    else:
+        user_dirs = sorted(
+            path
+            for path in args.root_dir.iterdir()
+            if path.is_dir() or path.suffix.lower() == ".zip"
+        )
+        with ProcessPoolExecutor(args.workers) as pool:
+            summaries = list(pool.map(summarize_user, user_dirs))
+    if args.summaries is not None and not args.merge:
+        args.summaries.mkdir(parents=True, exist_ok=True)
+        for user_dir, summary in zip(user_dirs, summaries):
+            summary.to_json(args.summaries / f"{user_dir.stem}.json")
+
+    cohort = merge_tree(summaries, args.workers)
+    if args.out is not None:
+        cohort.to_json(args.out)
+
+    print(f"{cohort.users} users, {cohort.plays} plays")
+    print(f"\nTop {args.top} songs (estimated plays, at least)")
+    for (artist, track), estimate, lower in cohort.top_songs(args.top):
+        print(f"{estimate:>10} {lower:>10}  {track} - {artist}")
+    print(f"\nTop {args.top} artists (estimated plays, at least)")
+    for artist, estimate, lower in cohort.top_artists(args.top):
+        print(f"{estimate:>10} {lower:>10}  {artist}")
+    print("\nPercent of listening time per hour")
+    print(" ".join(f"{100 * ms / cohort.ms_played:.1f}" for ms in cohort.hours))
+    print("Percent of listening time per weekday (Monday first)")
+    print(" ".join(f"{100 * ms / cohort.ms_played:.1f}" for ms in cohort.weekdays))
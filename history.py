@@ -0,0 +1,793 @@
+import io
+import re
+import json
+import hashlib
+import zipfile
+import numpy as np
+import pandas as pd
+from pathlib import Path, PurePosixPath
+from dataclasses import dataclass
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from profiling import NO_PROFILER
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    # Without pyarrow the cache falls back to pickle files
+    pq = None
+
+# Columns kept from each kind of export file, mapped to the names used in the frame.
+# Everything else (ip_addr, episode_*, audiobook_* ...) is never materialized
+SIMPLE_COLUMNS = {
+    "endTime": "endTime",
+    "artistName": "artistName",
+    "trackName": "trackName",
+    "msPlayed": "msPlayed",
+}
+EXTENDED_COLUMNS = {
+    "ts": "endTime",
+    "master_metadata_album_artist_name": "artistName",
+    "master_metadata_track_name": "trackName",
+    "ms_played": "msPlayed",
+    "platform": "platform",
+    "skipped": "skipped",
+}
+
+
+def iter_json_array(file, chunk_size: int = 1 << 16):
+    """Yield the elements of a top level JSON array one at a time.
+
+    The file is read in chunks of chunk_size characters so only the current
+    chunk and the element being decoded are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        # Skip whitespace and the array punctuation between elements
+        while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+            if buffer[position] == "[":
+                started = True
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                raise ValueError(f"{file.name} does not contain a JSON array")
+            try:
+                element, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                yield element
+                continue
+        elif eof:
+            return
+
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+@dataclass(frozen=True)
+class ZipMember:
+    """An export file inside a ZIP archive, the archive a path or a binary file.
+
+    name is the file name without the folders, like Path.name.
+    """
+
+    archive: object
+    member: str
+    size: int
+    crc: int
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+
+def is_archive(source) -> bool:
+    """Whether source is a ZIP archive, given as a path or a binary file."""
+    if hasattr(source, "read"):
+        return True
+    return Path(source).is_file() and zipfile.is_zipfile(source)
+
+
+@contextmanager
+def open_history_file(file_path, binary: bool = False):
+    """Open an export file, a Path or a ZipMember, as text or binary.
+
+    ZIP members are decompressed while they are read, nothing is extracted.
+    """
+    if not isinstance(file_path, ZipMember):
+        if binary:
+            with open(file_path, "rb") as file:
+                yield file
+        else:
+            with open(file_path, encoding="utf-8") as file:
+                yield file
+        return
+    with zipfile.ZipFile(file_path.archive) as archive:
+        with archive.open(file_path.member) as member:
+            yield member if binary else io.TextIOWrapper(member, encoding="utf-8")
+
+
+def read_history_file(file_path, columns: dict[str, str]) -> pd.DataFrame:
+    """Stream a history file into a frame holding only the given columns."""
+    data = {name: [] for name in columns.values()}
+    with open_history_file(file_path) as file:
+        for entry in iter_json_array(file):
+            for source, name in columns.items():
+                data[name].append(entry.get(source))
+    return pd.DataFrame(data)
+
+
+def read_history_file_chunks(file_path, columns: dict[str, str], chunk_rows: int):
+    """Stream a history file as normalized frames of at most chunk_rows plays."""
+    data = {name: [] for name in columns.values()}
+    with open_history_file(file_path) as file:
+        for entry in iter_json_array(file):
+            for source, name in columns.items():
+                data[name].append(entry.get(source))
+            if len(data["endTime"]) == chunk_rows:
+                yield normalize_history(pd.DataFrame(data))
+                data = {name: [] for name in columns.values()}
+    if data["endTime"]:
+        yield normalize_history(pd.DataFrame(data))
+
+
+# Partial, case insensitive, matches of the platform string and the device they
+# are counted as. The first matching pattern decides, platforms matching none
+# are counted as "Other"
+DEVICE_PATTERNS = {
+    "Windows": "Windows",
+    "Linux": "Linux",
+    r"ps5|ps4|ps3|ps2|playstation": "PlayStation",
+    "Android": "Android",
+    r"ios": "iOS",
+    r"osx|os x|macos": "macOS",
+}
+
+# File name patterns of the two kinds of export, matched against file names only
+STREAMING_HISTORY_SIMPLE = re.compile(r"StreamingHistory_music_\d+\.json")
+STREAMING_HISTORY_EXTENDED = re.compile(
+    r"Streaming_History_Audio_\d{4}(?:-\d{4})?_\d+\.json"
+)
+
+
+def history_sort_key(file_path) -> list:
+    """Order file names with their numbers compared numerically, _2 before _10."""
+    return [
+        int(part) if part.isdigit() else part
+        for part in re.split(r"(\d+)", file_path.name)
+    ]
+
+
+def find_history_files(directory) -> list[tuple[Path, dict[str, str]]]:
+    """List the export files in directory together with the columns to read from them.
+
+    directory can also be a ZIP archive, like the my_spotify_data.zip of an
+    export, as a path or binary file. Its members are matched on their file
+    names in any folder and listed as ZipMembers.
+    """
+    if is_archive(directory):
+        with zipfile.ZipFile(directory) as archive:
+            candidates = [
+                ZipMember(directory, info.filename, info.file_size, info.CRC)
+                for info in archive.infolist()
+                if not info.is_dir()
+            ]
+    else:
+        candidates = [path for path in Path(directory).iterdir() if path.is_file()]
+
+    files = []
+    for file_path in sorted(candidates, key=history_sort_key):
+        if STREAMING_HISTORY_SIMPLE.match(file_path.name):
+            files.append((file_path, SIMPLE_COLUMNS))
+        elif STREAMING_HISTORY_EXTENDED.match(file_path.name):
+            files.append((file_path, EXTENDED_COLUMNS))
+    return files
+
+
+def load_history_file(file_path, columns: dict[str, str]) -> pd.DataFrame:
+    """Read a single export file and convert its columns to their final types.
+
+    Kept at module level so it can be sent to worker processes.
+    """
+    return normalize_history(read_history_file(file_path, columns))
+
+
+def normalize_history(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse the end times (as UTC without time zone) and the ms played."""
+    df["endTime"] = pd.to_datetime(df["endTime"], utc=True).dt.tz_convert(None)
+    df["msPlayed"] = pd.to_numeric(df["msPlayed"])
+    return df
+
+
+def read_history(
+    files: list[tuple[Path, dict[str, str]]], workers: int = 1, profiler=NO_PROFILER
+) -> pd.DataFrame:
+    """Read the given export files into one normalized frame.
+
+    Each file is read on its own and the frames are concatenated once. With
+    workers > 1 the files are read and normalized in a pool of that many
+    processes.
+    """
+    # Members of archives open as files can not be sent to other processes
+    picklable = not any(
+        isinstance(file_path, ZipMember) and hasattr(file_path.archive, "read")
+        for file_path, _ in files
+    )
+    with profiler.span("read files") as span:
+        if workers > 1 and len(files) > 1 and picklable:
+            with ProcessPoolExecutor(max_workers=min(workers, len(files))) as pool:
+                frames = list(pool.map(load_history_file, *zip(*files)))
+        else:
+            frames = [
+                load_history_file(file_path, columns) for file_path, columns in files
+            ]
+        df = pd.concat(frames, ignore_index=True)
+        span["files"] = len(files)
+        span["rows"] = df.shape[0]
+
+    simple = any(columns is SIMPLE_COLUMNS for _, columns in files)
+    extended = any(columns is EXTENDED_COLUMNS for _, columns in files)
+    if simple and extended:
+        # Mixed exports only share the simple columns, skip and device stats
+        # can not be made for the simple entries
+        df = df.drop(["platform", "skipped"], axis=1)
+
+    with profiler.span("deduplicate") as span:
+        df = df[~play_keys(df).duplicated()].reset_index(drop=True)
+        span["rows"] = df.shape[0]
+    return df
+
+
+def play_keys(df: pd.DataFrame) -> pd.Series:
+    """64 bit hash identifying each play by its end time, track and ms played."""
+    return pd.util.hash_pandas_object(
+        df[["endTime", "artistName", "trackName", "msPlayed"]], index=False
+    )
+
+
+def compact_history(df: pd.DataFrame) -> pd.DataFrame:
+    """Store the frame with dictionary encoded names and narrow number types.
+
+    Artist, track and platform become categoricals, so grouping on them works
+    on integer codes instead of hashing every string again. Has to run on the
+    whole frame, categoricals with different categories do not concatenate.
+    """
+    for column in ["artistName", "trackName", "platform"]:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    df["msPlayed"] = df["msPlayed"].astype("int32")
+    if "skipped" in df.columns:
+        # Older extended entries have null instead of False
+        df["skipped"] = df["skipped"].fillna(False).astype(bool)
+    return df
+
+
+def sort_history(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values("endTime", kind="stable", ignore_index=True)
+
+
+def time_slice(df: pd.DataFrame, start, end, column: str = "endTime") -> pd.DataFrame:
+    """Rows of a frame sorted by column with start <= column < end.
+
+    Found by binary search on column, the result is a slice of df, not a copy.
+    """
+    first, last = df[column].searchsorted([pd.Timestamp(start), pd.Timestamp(end)])
+    return df.iloc[first:last]
+
+
+def classify_devices(
+    df: pd.DataFrame, device_patterns: dict[str, str] = DEVICE_PATTERNS
+) -> pd.DataFrame:
+    """Add a categorical device column derived from the platform column.
+
+    Every distinct platform string is matched against device_patterns once,
+    the plays then only look up the device of their platform code.
+    """
+    # Patterns may count platforms as "Other" too, it is only listed once
+    devices = list(dict.fromkeys([*device_patterns.values(), "Other"]))
+    other = devices.index("Other")
+    patterns = [
+        (re.compile(partial, re.IGNORECASE), devices.index(device))
+        for partial, device in device_patterns.items()
+    ]
+
+    def device_of(platform: str) -> int:
+        for pattern, device in patterns:
+            if pattern.search(platform):
+                return device
+        return other
+
+    # The extra last entry is the device of plays without a platform, code -1
+    device_codes = np.array(
+        [device_of(platform) for platform in df["platform"].cat.categories] + [other],
+        dtype=np.int8,
+    )
+    df["device"] = pd.Categorical.from_codes(
+        device_codes[df["platform"].cat.codes.to_numpy()], categories=devices
+    )
+    return df
+
+
+def is_extended(df: pd.DataFrame) -> bool:
+    """Whether the frame is made up purely of extended entries."""
+    return "skipped" in df.columns or "skipCount" in df.columns
+
+
+def file_identity(file_path) -> str:
+    """Name, size and mtime of an export file, which change whenever it does.
+
+    ZIP members are identified by their size and CRC instead of the mtime.
+    """
+    if isinstance(file_path, ZipMember):
+        return f"{file_path.member}:{file_path.size}:{file_path.crc}"
+    stat = file_path.stat()
+    return f"{file_path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def directory_hash(directory) -> str:
+    """Short hash naming the files kept for a history folder or archive.
+
+    Archives given as files are named after their file name, if any.
+    """
+    if hasattr(directory, "read"):
+        name = str(getattr(directory, "name", "archive"))
+    else:
+        name = str(Path(directory).resolve())
+    return hashlib.sha1(name.encode()).hexdigest()[:16]
+
+
+def history_cache_path(
+    cache_dir: Path, directory: Path, files: list[tuple[Path, dict[str, str]]]
+) -> Path:
+    """Cache file for directory, named after the names, sizes and mtimes of its files.
+
+    ZIP members are identified by their size and CRC instead of the mtime.
+    """
+    files_hash = hashlib.sha1()
+    for file_path, _ in files:
+        files_hash.update(f"{file_identity(file_path)};".encode())
+    suffix = ".parquet" if pq is not None else ".pkl"
+    return (
+        cache_dir / f"{directory_hash(directory)}_{files_hash.hexdigest()[:16]}{suffix}"
+    )
+
+
+def read_frame(path: Path, columns: list[str] = None) -> pd.DataFrame:
+    """Read a frame written by write_frame, optionally only some of its columns."""
+    if path.suffix == ".parquet":
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    df = pd.read_pickle(path)
+    return df if columns is None else df[columns]
+
+
+def write_frame(df: pd.DataFrame, path: Path) -> None:
+    """Write df to path, Parquet or pickle depending on its suffix."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write next to the target and rename so a crash never leaves a partial file
+    tmp_path = path.with_name(path.name + ".tmp")
+    if path.suffix == ".parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    tmp_path.replace(path)
+
+
+def write_history_cache(df: pd.DataFrame, cache_path: Path) -> None:
+    # Older caches of the same directory are stale once its files change
+    prefix = cache_path.name.split("_")[0]
+    if cache_path.parent.exists():
+        for stale in cache_path.parent.glob(f"{prefix}_*"):
+            stale.unlink()
+    write_frame(df, cache_path)
+
+
+def file_digest(file_path) -> str:
+    digest = hashlib.sha1()
+    with open_history_file(file_path, binary=True) as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def update_history_store(
+    store_dir: Path, directory: Path, workers: int = 1
+) -> pd.DataFrame:
+    """Add the plays of directory that are not in the store yet and return all of them.
+
+    The store is a directory of frame parts plus a manifest.json listing the
+    content digests of every export file ingested so far, and the digest of
+    each file_identity seen. A file is only hashed when its identity changed,
+    and files seen before are skipped without being parsed. Rows of new files
+    whose play key is already stored are dropped, so a fresh export
+    overlapping an old one only costs as much as the plays it adds. The new
+    rows are appended as one more part, existing parts are never rewritten.
+    """
+    store_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = store_dir / "manifest.json"
+    manifest = {"files": [], "parts": [], "identities": {}}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+    # Stores made before identities were recorded hash every file once more
+    identities = manifest.setdefault("identities", {})
+
+    seen = set(manifest["files"])
+    new_files = []
+    changed = False
+    for file_path, columns in find_history_files(directory):
+        identity = file_identity(file_path)
+        if identity in identities:
+            continue
+        digest = identities[identity] = file_digest(file_path)
+        changed = True
+        if digest not in seen:
+            seen.add(digest)
+            new_files.append((file_path, columns, digest))
+
+    if new_files:
+        df = read_history([(path, columns) for path, columns, _ in new_files], workers)
+        df["playKey"] = play_keys(df)
+        if manifest["parts"]:
+            stored_keys = pd.concat(
+                [
+                    read_frame(store_dir / part, ["playKey"])["playKey"]
+                    for part in manifest["parts"]
+                ]
+            )
+            df = df[~df["playKey"].isin(stored_keys)]
+
+        if not df.empty:
+            suffix = ".parquet" if pq is not None else ".pkl"
+            part = f"plays_{len(manifest['parts'])}{suffix}"
+            write_frame(df, store_dir / part)
+            manifest["parts"].append(part)
+        manifest["files"].extend(digest for _, _, digest in new_files)
+
+    if changed:
+        tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=1))
+        tmp_path.replace(manifest_path)
+
+    if not manifest["parts"]:
+        raise FileNotFoundError(f"No streaming history files found in {directory}")
+
+    parts = [read_frame(store_dir / part) for part in manifest["parts"]]
+    # Parts made from simple exports lack the extended only columns, only the
+    # columns shared by every part are kept, like for mixed exports
+    shared = [c for c in parts[0].columns if all(c in p.columns for p in parts)]
+    df = pd.concat([p[shared] for p in parts], ignore_index=True)
+    return df.drop(columns="playKey")
+
+
+def compact_sorted_history(df: pd.DataFrame, profiler=NO_PROFILER) -> pd.DataFrame:
+    """compact_history and sort_history, as one "normalize" span."""
+    with profiler.span("normalize") as span:
+        df = sort_history(compact_history(df))
+        span["rows"] = df.shape[0]
+    return df
+
+
+def load_history(
+    directory: Path,
+    workers: int = 1,
+    cache_dir: Path = None,
+    store_dir: Path = None,
+    profiler=NO_PROFILER,
+) -> tuple[pd.DataFrame, bool]:
+    """Read every export file in directory into one normalized frame.
+
+    directory is a folder or a ZIP archive (path or binary file), see
+    find_history_files. Archives given as files are not cached.
+    Files are read in the order given by history_sort_key, see read_history.
+    With a cache_dir the normalized frame is stored there as a columnar file
+    and reused as long as no export file is added, removed or modified.
+    With a store_dir the plays are instead added to a persistent store, see
+    update_history_store, and everything in the store is returned.
+    The frame is sorted by endTime. Returns the frame and whether it is made
+    up purely of extended entries.
+    """
+    if store_dir is not None:
+        with profiler.span("update store") as span:
+            df = update_history_store(Path(store_dir), directory, workers)
+            span["rows"] = df.shape[0]
+        df = compact_sorted_history(df, profiler)
+        return df, is_extended(df)
+
+    files = find_history_files(directory)
+    if not files:
+        raise FileNotFoundError(f"No streaming history files found in {directory}")
+
+    if cache_dir is None or hasattr(directory, "read"):
+        df = compact_sorted_history(read_history(files, workers, profiler), profiler)
+        return df, is_extended(df)
+
+    cache_path = history_cache_path(Path(cache_dir), directory, files)
+    if cache_path.exists():
+        with profiler.span("read cache") as span:
+            df = read_frame(cache_path)
+            span["rows"] = df.shape[0]
+    else:
+        df = compact_sorted_history(read_history(files, workers, profiler), profiler)
+        with profiler.span("write cache"):
+            write_history_cache(df, cache_path)
+    return df, is_extended(df)
+
+
+def write_row_groups(
+    files: list[tuple[Path, dict[str, str]]], chunk_dir: Path, chunk_rows: int
+):
+    """Stream the export files into parts of at most chunk_rows plays in chunk_dir.
+
+    Only one chunk is held in memory at a time. Parts of an earlier run are
+    replaced. Yields each part file and its compact plays, sorted by endTime.
+    """
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    for stale in chunk_dir.glob("rows_*"):
+        stale.unlink()
+
+    # Mixed exports only share the simple columns, like in read_history
+    mixed = any(columns is SIMPLE_COLUMNS for _, columns in files) and any(
+        columns is EXTENDED_COLUMNS for _, columns in files
+    )
+    suffix = ".parquet" if pq is not None else ".pkl"
+    nrof_parts = 0
+    for file_path, columns in files:
+        for df in read_history_file_chunks(file_path, columns, chunk_rows):
+            if mixed:
+                df = df.drop(columns=["platform", "skipped"], errors="ignore")
+            df = sort_history(compact_history(df))
+            part = chunk_dir / f"rows_{nrof_parts}{suffix}"
+            write_frame(df, part)
+            nrof_parts += 1
+            yield part, df
+
+
+def daily_totals(df: pd.DataFrame) -> pd.DataFrame:
+    """Plays, ms played and, for extended plays, skips summed per day and platform.
+
+    Has at most one row per day and platform, however many plays df holds.
+    """
+    totals = pd.DataFrame(
+        {
+            "endTime": df["endTime"].dt.floor("D"),
+            "playCount": np.ones(df.shape[0], dtype=np.int64),
+            "msPlayed": df["msPlayed"].astype(np.int64),
+        }
+    )
+    keys = ["endTime"]
+    if "platform" in df.columns:
+        totals["platform"] = df["platform"].astype(object)
+        keys.append("platform")
+    if "skipped" in df.columns:
+        totals["skipCount"] = df["skipped"].astype(np.int64)
+    return totals.groupby(keys, dropna=False, sort=False).sum().reset_index()
+
+
+@dataclass
+class ChunkedHistory:
+    """A history loaded out of core by load_history_chunked.
+
+    plays holds the plays summed per day and platform, without names, and
+    stands in for the history wherever only days and platforms matter. The
+    plays themselves stay in the parts on disk, in time order, and are
+    streamed again by period_totals and key_daily. part_spans are the first
+    and last endTime of each part.
+    artists, tracks and songs hold every name of the history, sorted. Their
+    positions are the artist and song codes, songs is a song table like the
+    one of build_daily_cube and song_keys its artist * len(tracks) + track
+    codes, sorted.
+    """
+
+    parts: list[Path]
+    part_spans: list[tuple[pd.Timestamp, pd.Timestamp]]
+    plays: pd.DataFrame
+    artists: pd.Index
+    tracks: pd.Index
+    song_keys: np.ndarray
+    songs: pd.DataFrame
+    extended: bool
+
+
+def name_codes(names: pd.Series, index: pd.Index) -> np.ndarray:
+    """Positions in index of the categorical names, -1 where missing."""
+    # The extra last entry is looked up by missing names, code -1
+    lookup = np.append(index.get_indexer(names.cat.categories), -1)
+    return lookup[names.cat.codes.to_numpy()]
+
+
+def part_codes(
+    history: ChunkedHistory, df: pd.DataFrame
+) -> tuple[np.ndarray, np.ndarray]:
+    """Artist and song codes of the plays of a part, -1 where the name is missing."""
+    artist = name_codes(df["artistName"], history.artists)
+    track = name_codes(df["trackName"], history.tracks)
+    song = np.full(df.shape[0], -1, dtype=np.int64)
+    valid = (artist >= 0) & (track >= 0)
+    song[valid] = np.searchsorted(
+        history.song_keys,
+        artist[valid].astype(np.int64) * len(history.tracks) + track[valid],
+    )
+    return artist, song
+
+
+def period_parts(history: ChunkedHistory, start, end):
+    """The plays of each part with start <= endTime < end, one part at a time."""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    for part, (first, last) in zip(history.parts, history.part_spans):
+        if last >= start and first < end:
+            df = time_slice(read_frame(part), start, end)
+            if not df.empty:
+                yield df
+
+
+def play_measures(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """playCount, msPlayed and skipCount of each play in a part."""
+    return {
+        "playCount": np.ones(df.shape[0], dtype=np.int64),
+        "msPlayed": df["msPlayed"].to_numpy().astype(np.int64),
+        "skipCount": (
+            df["skipped"].to_numpy().astype(np.int64)
+            if "skipped" in df.columns
+            else np.zeros(df.shape[0], dtype=np.int64)
+        ),
+    }
+
+
+def period_totals(history: ChunkedHistory, start, end) -> dict[str, pd.DataFrame]:
+    """Plays, ms played and skips per song, artist and hour of the day with
+    start <= endTime < end.
+
+    One pass over the parts in the period, summing into arrays with one entry
+    per song and artist of the history and per hour. Returns a frame for each
+    of "song", "artist" and "hour", row i holding i in that column, so they
+    can stand in for the daily cube in Ranking, the skip stats and the hours.
+    """
+    codes = {"song": len(history.songs), "artist": len(history.artists), "hour": 24}
+    totals = {
+        column: {
+            measure: np.zeros(size, dtype=np.int64)
+            for measure in ("playCount", "msPlayed", "skipCount")
+        }
+        for column, size in codes.items()
+    }
+    for df in period_parts(history, start, end):
+        artist, song = part_codes(history, df)
+        measures = play_measures(df)
+        hour = df["endTime"].dt.hour.to_numpy().astype(np.int64)
+        for column, key in (("song", song), ("artist", artist), ("hour", hour)):
+            played = key >= 0
+            for measure, values in measures.items():
+                totals[column][measure] += np.bincount(
+                    key[played], weights=values[played], minlength=codes[column]
+                ).astype(np.int64)
+    return {
+        column: pd.DataFrame({column: np.arange(size, dtype=np.int64)} | totals[column])
+        for column, size in codes.items()
+    }
+
+
+def key_daily(history: ChunkedHistory, column: str, keys, start, end) -> pd.DataFrame:
+    """Plays, ms played and skips per day of the songs or artists (column) in keys.
+
+    One pass over the parts in the period. The result has a row per day and
+    key played, sorted by day, like the rows of the daily cube daily_matrix
+    uses.
+    """
+    keys = np.asarray(keys)
+    frames = []
+    for df in period_parts(history, start, end):
+        artist, song = part_codes(history, df)
+        codes = song if column == "song" else artist
+        selected = np.isin(codes, keys)
+        frames.append(
+            pd.DataFrame(
+                {
+                    "day": df["endTime"].dt.floor("D").to_numpy()[selected],
+                    column: codes[selected],
+                }
+                | {
+                    measure: values[selected]
+                    for measure, values in play_measures(df).items()
+                }
+            )
+            .groupby(["day", column])
+            .sum()
+            .reset_index()
+        )
+    if not frames:
+        return pd.DataFrame(
+            {
+                "day": pd.Series([], dtype="datetime64[ns]"),
+                column: pd.Series([], dtype=np.int64),
+            }
+            | {
+                measure: pd.Series([], dtype=np.int64)
+                for measure in ("playCount", "msPlayed", "skipCount")
+            }
+        )
+    # Parts only share the days at their edges, this sums those
+    return pd.concat(frames).groupby(["day", column]).sum().reset_index()
+
+
+def load_history_chunked(
+    directory: Path,
+    chunk_dir: Path,
+    chunk_rows: int = 1_000_000,
+    profiler=NO_PROFILER,
+) -> tuple[ChunkedHistory, bool]:
+    """Load the history of directory without holding all of its plays in memory.
+
+    The export files are streamed into parts of chunk_rows plays in a folder
+    of chunk_dir named after directory_hash, so histories loaded through the
+    same chunk_dir keep their own parts, see write_row_groups. Each part is
+    reduced to its daily_totals and the names it holds. Memory is bounded by
+    one chunk, the days and platforms played and the distinct songs, not by
+    the plays. Song, artist and hour totals and daily series of songs and
+    artists are streamed from the parts when asked for, see ChunkedHistory.
+    Plays are not de-duplicated across files, overlapping exports should be
+    added to a history store first.
+    Returns the ChunkedHistory and whether it is made up purely of extended
+    entries.
+    """
+    files = find_history_files(directory)
+    if not files:
+        raise FileNotFoundError(f"No streaming history files found in {directory}")
+
+    parts, part_spans, daily = [], [], []
+    artists, songs = set(), set()
+    with profiler.span("reduce parts") as span:
+        part_dir = Path(chunk_dir) / directory_hash(directory)
+        for part, df in write_row_groups(files, part_dir, chunk_rows):
+            parts.append(part)
+            part_spans.append((df["endTime"].iloc[0], df["endTime"].iloc[-1]))
+            daily.append(daily_totals(df))
+            artists.update(df["artistName"].cat.categories)
+            names = df[["artistName", "trackName"]].dropna().drop_duplicates()
+            songs.update(zip(names["artistName"], names["trackName"]))
+            extended = "skipped" in df.columns
+        span["parts"] = len(parts)
+
+    with profiler.span("merge daily totals") as span:
+        # Parts only share the days at their edges
+        plays = pd.concat(daily, ignore_index=True)
+        keys = [key for key in ("endTime", "platform") if key in plays.columns]
+        plays = plays.groupby(keys, dropna=False).sum().reset_index()
+        if "platform" in plays.columns:
+            plays["platform"] = plays["platform"].astype("category")
+        span["rows"] = plays.shape[0]
+
+    artists = pd.Index(sorted(artists))
+    tracks = pd.Index(sorted({track for _, track in songs}))
+    song_artists = artists.get_indexer([artist for artist, _ in songs])
+    song_tracks = tracks.get_indexer([track for _, track in songs])
+    song_keys = np.unique(song_artists.astype(np.int64) * len(tracks) + song_tracks)
+    song_artist = (song_keys // len(tracks)).astype(np.int32)
+    song_table = pd.DataFrame(
+        {
+            "artistName": pd.Categorical.from_codes(song_artist, categories=artists),
+            "trackName": pd.Categorical.from_codes(
+                song_keys % len(tracks), categories=tracks
+            ),
+            "artist": song_artist,
+        }
+    )
+    history = ChunkedHistory(
+        parts=parts,
+        part_spans=part_spans,
+        plays=sort_history(plays),
+        artists=artists,
+        tracks=tracks,
+        song_keys=song_keys,
+        songs=song_table,
+        extended=extended,
+    )
+    return history, extended
@@ -1,412 +1,662 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
 
-plt.rcParams["font.family"] = "Meiryo"
-
-import re
 from pathlib import Path
 from datetime import date, timedelta
-from matplotlib.backends.backend_pdf import PdfPages
+
+from render import Page, write_pdf, FONT_FAMILIES
+from stats import WrappedStats
+from sketches import CohortSummary, SpaceSaving, CountMinSketch
+from profiling import NO_PROFILER, spanned
+from history import (
+    load_history,
+    load_history_chunked,
+    period_totals,
+    key_daily,
+    time_slice,
+    ChunkedHistory,
+    classify_devices,
+    DEVICE_PATTERNS,
+)
+from aggregates import (
+    build_daily_cube,
+    daily_series,
+    daily_matrix,
+    rolling_mean,
+    active_spans,
+    downsample,
+    Ranking,
+)
 
 
 class WrappedMaker:
     # -------------
+    _history: pd.DataFrame
     _df: pd.DataFrame
-    _pdf_pages: PdfPages
 
-    _top_songs: pd.DataFrame = None
-    _top_artists: pd.DataFrame = None
+    # Pages of the pdf being made, drawn by write_to_file
+    _pages: list[Page]
+    _pdf_path: Path
+    _render_workers: int = 1
+    _font_families: tuple[str, ...]
+    _page_cache_dir: Path = None
+    # Most points drawn by the lines of one chart together, None draws every day
+    _chart_point_budget: int = None
+
+    # Song and artist rankings of the selected period
+    _song_ranking: Ranking = None
+    _artist_ranking: Ranking = None
+
+    # Daily cube of the whole history, of the selected period and its song table
+    _history_daily: pd.DataFrame = None
+    _daily: pd.DataFrame = None
+    _songs: pd.DataFrame = None
 
     _extended: bool = False
 
+    # History loaded out of core, then _history only holds the plays per day
+    # and platform, and song, artist and hour totals of the period are
+    # streamed from its parts
+    _chunked: ChunkedHistory = None
+    _period_totals: dict[str, pd.DataFrame] = None
+
+    # Records the spans of loading, aggregating and drawing, see profiling.py
+    profiler = NO_PROFILER
+
     def __init__(
         self,
         start_date: date = date(1, 1, 1),
         end_date: date = date(4000, 12, 31),
         pdf_target_path: Path = Path("."),
         history_src_dir: Path = Path("./StreamingHistory"),
+        workers: int = 1,
+        cache_dir: Path = None,
+        store_dir: Path = None,
+        device_patterns: dict[str, str] = DEVICE_PATTERNS,
+        render_workers: int = 1,
+        font_families: tuple[str, ...] = FONT_FAMILIES,
+        chunk_dir: Path = None,
+        chunk_rows: int = 1_000_000,
+        profiler=NO_PROFILER,
+        page_cache_dir: Path = None,
+        chart_point_budget: int = 8000,
     ) -> pd.DataFrame:
-        self._df = pd.DataFrame()
-        directory = Path(history_src_dir)
-        streaming_history_simple = re.compile(r"StreamingHistory_music_\d+\.json")
-        streaming_history_extended = re.compile(
-            r"Streaming_History_Audio_\d{4}(?:-\d{4})?_\d+\.json"
-        )
-        simple: bool = False
-        for file_path in directory.iterdir():
-            if file_path.is_file():
-                if streaming_history_simple.match(file_path.name):
-                    self._df = pd.concat([self._df, pd.read_json(file_path)])
-                    simple = True
-                if streaming_history_extended.match(file_path.name):
-                    self._df = pd.concat([self._df, pd.read_json(file_path)])
-                    self._extended = True
-        if simple and self._extended:
-            self._df = self._df.drop(
-                [
-                    "platform",
-                    "master_metadata_album_album_name",
-                    "spotify_track_uri",
-                    "reason_start",
-                    "reason_end",
-                    "shuffle",
-                    "skipped",
-                    "platform",
-                ]
-            )
+        self.profiler = profiler
+        self._page_cache_dir = page_cache_dir
+        self._chart_point_budget = chart_point_budget
+        # history_src_dir is a folder or the export ZIP, as a path or binary file
+        if not hasattr(history_src_dir, "read"):
+            history_src_dir = Path(history_src_dir)
+        with profiler.span("ingest") as span:
+            # With a chunk_dir the history is loaded out of core, see
+            # load_history_chunked
+            if chunk_dir is not None:
+                self._chunked, self._extended = load_history_chunked(
+                    history_src_dir, chunk_dir, chunk_rows, profiler
+                )
+                self._history = self._chunked.plays
+            else:
+                self._history, self._extended = load_history(
+                    history_src_dir, workers, cache_dir, store_dir, profiler
+                )
+            span["rows"] = self._history.shape[0]
         if self._extended:
-            self._df.rename(
-                columns={
-                    "master_metadata_track_name": "trackName",
-                    "master_metadata_album_artist_name": "artistName",
-                    "ts": "endTime",
-                    "ms_played": "msPlayed",
-                },
-                inplace=True,
-            )
-            self._df = self._df.drop(
-                [
-                    "conn_country",
-                    "ip_addr",
-                    "episode_name",
-                    "episode_show_name",
-                    "spotify_episode_uri",
-                    "audiobook_title",
-                    "audiobook_uri",
-                    "audiobook_chapter_uri",
-                    "audiobook_chapter_title",
-                    "offline",
-                    "offline_timestamp",
-                    "incognito_mode",
-                ],
-                axis=1,
-            )
+            with profiler.span("classify devices"):
+                self._history = classify_devices(self._history, device_patterns)
+        self.select_period(start_date, end_date)
 
-        self._df = self._df.drop_duplicates()
+        self._render_workers = render_workers
+        self._font_families = tuple(font_families)
+        self.open_pdf(Path.joinpath(pdf_target_path, "Wrapped.pdf"))
 
-        self._df["endTime"] = pd.to_datetime(self._df["endTime"]).dt.tz_convert(None)
-        self._df["msPlayed"] = pd.to_numeric(self._df["msPlayed"])
+    def select_period(self, start_date: date, end_date: date) -> None:
+        """Make the following pages cover start_date to end_date, both days included.
 
-        self.__start_date = max(start_date, self._df["endTime"].min().date())
+        The loaded history is kept sorted by endTime, so this is a binary search
+        and a slice, and can be called any number of times on the same history.
+        """
+        self.__start_date = max(start_date, self._history["endTime"].iloc[0].date())
         self.__end_date = min(
             end_date + timedelta(days=1),
-            self._df["endTime"].max().date() + timedelta(days=1),
+            self._history["endTime"].iloc[-1].date() + timedelta(days=1),
         )
+        self._df = time_slice(self._history, self.__start_date, self.__end_date)
+
+        # Aggregates belong to the previous period
+        self._song_ranking = None
+        self._artist_ranking = None
+        self._daily = None
+        self._period_totals = None
+
+    def split_periods(self, frequency: str) -> list[tuple[str, date, date]]:
+        """Calendar periods with plays in the history, as (name, first day, last day).
+
+        frequency is "year" or "quarter". Periods without plays, like a
+        quarter away from Spotify, are left out.
+        """
+        freq = {"year": "Y", "quarter": "Q"}[frequency]
+        return [
+            (str(period), period.start_time.date(), period.end_time.date())
+            for period in self._history["endTime"].dt.to_period(freq).unique()
+        ]
 
-        self._df = self._df.query(
-            f"endTime >= '{self.__start_date}' & endTime <= '{self.__end_date}'"
+    @property
+    def nrof_plays(self) -> int:
+        """Number of plays in the selected period."""
+        if "playCount" in self._df.columns:
+            return int(self._df["playCount"].sum())
+        return self._df.shape[0]
+
+    @property
+    def pages(self) -> list[Page]:
+        """Pages added since open_pdf, not drawn yet."""
+        return self._pages
+
+    def memory_usage(self) -> int:
+        """Bytes held by the loaded history and its aggregates."""
+        frames = [self._history, self._history_daily, self._songs]
+        return sum(
+            int(frame.memory_usage(deep=True).sum())
+            for frame in frames
+            if frame is not None
         )
 
-        self._pdf_pages = PdfPages(Path.joinpath(pdf_target_path, "Wrapped.pdf"))
+    def open_pdf(self, pdf_path: Path) -> None:
+        """Write the following pages to pdf_path, until the next write_to_file."""
+        self._pdf_path = pdf_path
+        self._pages = []
+
+    def __make_daily_cube(self) -> None:
+        """Build the daily cube of the history once and cut out the selected period."""
+        if self._history_daily is None:
+            with self.profiler.span("daily cube") as span:
+                self._history_daily, self._songs = build_daily_cube(self._history)
+                span["rows"] = self._history_daily.shape[0]
+            if self._chunked is not None:
+                self._songs = self._chunked.songs
+        if self._daily is None:
+            self._daily = time_slice(
+                self._history_daily, self.__start_date, self.__end_date, "day"
+            )
+
+    @property
+    def __artist_names(self) -> pd.Index:
+        """Artist names by artist code."""
+        if self._chunked is not None:
+            return self._chunked.artists
+        return self._history["artistName"].cat.categories
+
+    def __key_totals(self, column: str) -> pd.DataFrame:
+        """Rows with song, artist or hour (column) codes and their plays in the period.
+
+        The daily cube, or out of core the totals streamed from the parts.
+        """
+        self.__make_daily_cube()
+        if self._chunked is None:
+            return self._daily
+        if self._period_totals is None:
+            with self.profiler.span("period totals"):
+                # Like in the daily cube, only what was played in the period
+                self._period_totals = {
+                    column: totals[totals["playCount"] > 0]
+                    for column, totals in period_totals(
+                        self._chunked, self.__start_date, self.__end_date
+                    ).items()
+                }
+        return self._period_totals[column]
+
+    def __key_daily_matrix(
+        self, column: str, keys
+    ) -> tuple[pd.DatetimeIndex, np.ndarray]:
+        """daily_matrix of the play counts of the songs or artists (column) in keys."""
+        self.__make_daily_cube()
+        daily = self._daily
+        if self._chunked is not None:
+            with self.profiler.span("key daily"):
+                daily = key_daily(
+                    self._chunked, column, keys, self.__start_date, self.__end_date
+                )
+        return daily_matrix(daily, column, keys)
+
+    def __song_names(self, songs) -> pd.MultiIndex:
+        return pd.MultiIndex.from_frame(
+            self._songs.loc[songs, ["artistName", "trackName"]]
+        )
+
+    def __song_skips(self, daily: pd.DataFrame) -> pd.DataFrame:
+        """Not skipped (False) and skipped (True) plays per song in daily."""
+        per_song = (
+            daily.groupby("song")[["playCount", "skipCount"]]
+            .sum()
+            .drop(-1, errors="ignore")
+        )
+        return pd.DataFrame(
+            {
+                False: (per_song["playCount"] - per_song["skipCount"]).to_numpy(),
+                True: per_song["skipCount"].to_numpy(),
+            },
+            index=self.__song_names(per_song.index),
+        )
 
     # ----------------
 
     # Front page
+    @spanned
     def front_page(self) -> None:
-        plt.figure(figsize=(16, 9))  # Standard letter size
-        plt.text(0.5, 0.95, "Spotify Wrapped", fontsize=30, ha="center", va="top")
+        self.__make_daily_cube()
+        total_ms = self._daily["msPlayed"].sum()
+
         period = self.__end_date - self.__start_date
         info_string = f"Stats for period {self.__start_date} to {self.__end_date}\n".join(
             [
-                f"Total listening time: {(self._df["msPlayed"].sum() / 3600000).round(2)}h\n",
-                f"Average listening time per day: {(self._df['msPlayed'].sum() / period.days / 3600000).round(2)}h\n",
+                f"Total listening time: {(total_ms / 3600000).round(2)}h\n",
+                f"Average listening time per day: {(total_ms / period.days / 3600000).round(2)}h\n",
             ]
         )
 
-        plt.text(0.5, 0.85, info_string, fontsize=20, ha="center", va="top")
-        plt.axis("off")  # Hide axes
-
-        # Save the text page to the PDF
-        self._pdf_pages.savefig()
-        plt.close()
-
-    def __make_top_songs(self, nrof_songs) -> None:
-        if self._top_songs is None or self._top_songs.shape[0] < nrof_songs:
-            top_songs = (
-                self._df.groupby(["artistName", "trackName"])["msPlayed"]
-                .count()
-                .sort_values(ascending=False)
-                .rename("playCount")
-                .head(nrof_songs)
-            )
-            self._top_songs = pd.DataFrame(top_songs).sort_values(
-                by="playCount", ascending=True
-            )
-
-    def top_songs(self, nrof_songs: int = 10) -> None:
-        self.__make_top_songs(nrof_songs)
-
-        top_songs_df = self._top_songs.head(nrof_songs)
-
-        plt.figure(figsize=(16, 9))
-
-        plt.barh(
-            [str(i[1]) + " - " + str(i[0]) for i in top_songs_df.index],
-            top_songs_df["playCount"],
-            color="skyblue",
+        self._pages.append(Page("text", title="Spotify Wrapped", text=info_string))
+
+    def __make_rankings(self) -> None:
+        if self._song_ranking is None:
+            self.__make_daily_cube()
+            songs, artists = self.__key_totals("song"), self.__key_totals("artist")
+            with self.profiler.span("rankings"):
+                self._song_ranking = Ranking(
+                    songs["song"].to_numpy(), songs, self._songs.shape[0]
+                )
+                self._artist_ranking = Ranking(
+                    artists["artist"].to_numpy(), artists, len(self.__artist_names)
+                )
+
+    @spanned
+    def rank_songs(self, nrof_songs: int, by: str = "playCount") -> pd.DataFrame:
+        """The nrof_songs most played songs of the period, most played first.
+
+        by is "playCount" or "msPlayed". Indexed by artistName and trackName,
+        with both totals and the song code as columns.
+        """
+        self.__make_rankings()
+        songs = self._song_ranking.top(nrof_songs, by)
+        return pd.DataFrame(
+            {
+                "playCount": self._song_ranking.totals["playCount"][songs],
+                "msPlayed": self._song_ranking.totals["msPlayed"][songs],
+                "song": songs,
+            },
+            index=self.__song_names(songs),
         )
-        for index, value in enumerate(top_songs_df["playCount"]):
-            plt.text(
-                value / 2, index, f"{value}", ha="center", va="center", fontsize=15
-            )
 
-        plt.title(f"Top {nrof_songs} songs", fontsize=20)
-        plt.ylabel("Song Title", fontsize=15)
-        plt.xlabel("Play Count", fontsize=15)
+    @spanned
+    def rank_artists(self, nrof_artists: int, by: str = "playCount") -> pd.DataFrame:
+        """The nrof_artists most played artists of the period, most played first.
+
+        by is "playCount" or "msPlayed". Indexed by artistName, with both
+        totals and the artist code as columns.
+        """
+        self.__make_rankings()
+        artists = self._artist_ranking.top(nrof_artists, by)
+        return pd.DataFrame(
+            {
+                "playCount": self._artist_ranking.totals["playCount"][artists],
+                "msPlayed": self._artist_ranking.totals["msPlayed"][artists],
+                "artist": artists,
+            },
+            index=pd.Index(self.__artist_names[artists], name="artistName"),
+        )
 
-        plt.yticks(fontsize=15)
-        plt.xticks(fontsize=15)
+    @spanned
+    def top_songs(self, nrof_songs: int = 10, by: str = "playCount") -> None:
+        # Least played first, barh draws bottom up
+        top_songs_df = self.rank_songs(nrof_songs, by).iloc[::-1]
+        values, value_label, title = self.__ranking_labels(top_songs_df, by)
+
+        self._pages.append(
+            Page(
+                "barh",
+                title=f"Top {nrof_songs} songs{title}",
+                xlabel=value_label,
+                ylabel="Song Title",
+                labels=[str(i[1]) + " - " + str(i[0]) for i in top_songs_df.index],
+                values=list(values),
+                annotations=[
+                    (value / 2, index, f"{value}", "center")
+                    for index, value in enumerate(values)
+                ],
+            )
+        )
 
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-        self._top_songs = top_songs_df
+    @staticmethod
+    def __ranking_labels(ranked: pd.DataFrame, by: str) -> tuple[pd.Series, str, str]:
+        """Bar values, axis label and title suffix of a top list ranked by by."""
+        if by == "msPlayed":
+            return (
+                (ranked["msPlayed"] / 3600000).round(1),
+                "Listening time (hours)",
+                " by listening time",
+            )
+        return ranked["playCount"], "Play Count", ""
 
+    @spanned
     def top_songs_chart(self, nrof_songs: int = 10, rolling_window: int = 31):
-        self.__make_top_songs(nrof_songs)
-
-        top_songs_full = self._df[
-            self._df.set_index(["artistName", "trackName"]).index.isin(
-                self._top_songs.head(nrof_songs).index
+        top_songs_df = self.rank_songs(nrof_songs)
+
+        # One column of daily play counts per song, each song's line runs from
+        # its first to its last play in the period
+        days, top_songs_daily = self.__key_daily_matrix("song", top_songs_df["song"])
+        first, last = active_spans(top_songs_daily)
+        rolling_playCount = rolling_mean(top_songs_daily, rolling_window, first)
+
+        self._pages.append(
+            Page(
+                "lines",
+                title=f"Top {nrof_songs} Songs listening time rolling {rolling_window} day average",
+                xlabel="Date",
+                ylabel="Play Count",
+                lines=self.__downsampled(
+                    [
+                        (
+                            days[first[i] : last[i] + 1].to_numpy(),
+                            rolling_playCount[first[i] : last[i] + 1, i],
+                            f"{track}",
+                        )
+                        for i, (artist, track) in enumerate(top_songs_df.index)
+                    ]
+                ),
+                legend_fontsize=15,
+                grid=True,
             )
-        ]
-
-        top_songs_daily = (
-            top_songs_full.groupby(["artistName", "trackName"])
-            .resample("d", on="endTime")
-            .count()
         )
-        top_songs_daily["playCount"] = top_songs_daily["artistName"]
-        top_songs_daily = top_songs_daily.drop(
-            ["artistName", "trackName", "msPlayed"], axis=1
-        )
-
-        plt.figure(figsize=(16, 9))
 
-        for artist, track in reversed(self._top_songs.index):
-            song_data = top_songs_daily.query(
-                f"artistName == @artist & trackName == @track"
-            ).reset_index()
-            song_data["rolling_playCount"] = (
-                song_data["playCount"].rolling(window=rolling_window).mean()
-            )
-            plt.plot(
-                song_data["endTime"], song_data["rolling_playCount"], label=f"{track}"
+    @spanned
+    def top_artists(self, nrof_artists: int = 10, by: str = "playCount") -> None:
+        # Least played first, barh draws bottom up
+        top_artist_df = self.rank_artists(nrof_artists, by).iloc[::-1]
+        values, value_label, title = self.__ranking_labels(top_artist_df, by)
+
+        self._pages.append(
+            Page(
+                "barh",
+                title=f"Top {nrof_artists} artists{title}",
+                xlabel=value_label,
+                ylabel="Artist name",
+                labels=list(top_artist_df.index),
+                values=list(values),
+                annotations=[
+                    (value / 2, index, f"{value}", "center")
+                    for index, value in enumerate(values)
+                ],
             )
-
-        plt.legend(fontsize=15)
-        plt.title(
-            f"Top {nrof_songs} Songs listening time rolling {rolling_window} day average",
-            fontsize=20,
         )
-        plt.xlabel("Date", fontsize=15)
-        plt.ylabel("Play Count", fontsize=15)
-        plt.grid()
-
-        plt.yticks(fontsize=15)
-        plt.xticks(fontsize=15)
-
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-
-    def __make_top_artist(self, nrof_artists) -> None:
-        if self._top_artists is None or self._top_artists.shape[0] < nrof_artists:
-            top_artists = (
-                self._df.groupby(["artistName"])["msPlayed"]
-                .count()
-                .sort_values(ascending=False)
-                .rename("playCount")
-                .head(nrof_artists)
-            )
-            self._top_artists = pd.DataFrame(top_artists).sort_values(
-                by="playCount", ascending=True
-            )
-
-    def top_artists(self, nrof_artists: int = 10) -> None:
 
-        self.__make_top_artist(nrof_artists)
-
-        top_artist_df = self._top_artists.head(nrof_artists)
-
-        plt.figure(figsize=(16, 9))
-
-        top_artist_df = top_artist_df.sort_values(by="playCount", ascending=True)
+    @spanned
+    def top_artists_chart(self, nrof_artists: int = 10, rolling_window: int = 31):
+        top_artist_df = self.rank_artists(nrof_artists)
 
-        plt.barh(top_artist_df.index, top_artist_df["playCount"], color="skyblue")
-        for index, value in enumerate(top_artist_df["playCount"]):
-            plt.text(
-                value / 2, index, f"{value}", ha="center", va="center", fontsize=15
+        days, top_artists_daily = self.__key_daily_matrix(
+            "artist", top_artist_df["artist"]
+        )
+        first, last = active_spans(top_artists_daily)
+        rolling_playcount = rolling_mean(top_artists_daily, rolling_window, first)
+
+        self._pages.append(
+            Page(
+                "lines",
+                title=f"Top {nrof_artists} artists listening time rolling {rolling_window} day average",
+                xlabel="Date",
+                ylabel="Play Count",
+                lines=self.__downsampled(
+                    [
+                        (
+                            days[first[i] : last[i] + 1].to_numpy(),
+                            rolling_playcount[first[i] : last[i] + 1, i],
+                            f"{artist}",
+                        )
+                        for i, artist in enumerate(top_artist_df.index)
+                    ]
+                ),
+                legend_fontsize=15,
+                grid=True,
             )
+        )
 
-        plt.title(f"Top {nrof_artists} artists", fontsize=20)
-        plt.ylabel("Artist name", fontsize=15)
-        plt.xlabel("Play Count", fontsize=15)
-
-        plt.yticks(fontsize=15)
-        plt.xticks(fontsize=15)
-
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-
-        self._top_artists = top_artist_df
+    @spanned
+    def daily_play_time(self) -> pd.Series:
+        """ms played per day, from the first to the last day played in the period."""
+        self.__make_daily_cube()
+        return daily_series(self._daily.groupby("day")["msPlayed"].sum())
+
+    @spanned
+    def hourly_play_time(self) -> pd.Series:
+        """ms played in each hour of the day, indexed 0 to 23."""
+        self.__make_daily_cube()
+        hours = self.__key_totals("hour")
+        ms_per_hour = hours.groupby("hour")["msPlayed"].sum()
+        return ms_per_hour.reindex(range(24), fill_value=0)
+
+    @spanned
+    def weekday_play_time(self) -> pd.Series:
+        """ms played on each weekday, indexed 0 (Monday) to 6."""
+        self.__make_daily_cube()
+        listen_time_weekday = self._daily.groupby(self._daily["day"].dt.weekday)[
+            "msPlayed"
+        ].sum()
+        return listen_time_weekday.reindex(range(7), fill_value=0)
+
+    @spanned
+    def device_play_time(self) -> pd.Series:
+        """ms played per device, extended histories only."""
+        self.__make_daily_cube()
+        devices = self._history["device"].cat.categories
+        return pd.Series(
+            self._daily.groupby("device")["msPlayed"]
+            .sum()
+            .reindex(range(len(devices)), fill_value=0)
+            .to_numpy(),
+            index=pd.Index(devices, name="device"),
+            name="msPlayed",
+        )
 
-    def top_artists_chart(self, nrof_artists: int = 10, rolling_window: int = 31):
-        self.__make_top_artist(nrof_artists)
+    @spanned
+    def song_skip_rates(self, least_amount_listens: int = 0) -> pd.DataFrame:
+        """Plays, skips and percent skipped of the songs played at least
+        least_amount_listens times, extended histories only."""
+        self.__make_daily_cube()
+        grouped = self.__song_skips(self.__key_totals("song"))
+        grouped["total"] = grouped[True] + grouped[False]
+        grouped = grouped[grouped["total"] >= least_amount_listens]
+        grouped["percent_skipped"] = (grouped[True] / grouped["total"]) * 100
+        return grouped
 
-        top_artists_full = self._df[
-            self._df.set_index(["artistName"]).index.isin(
-                self._top_artists.head(nrof_artists).index
+    @spanned
+    def compute(
+        self,
+        nrof_songs: int = 10,
+        nrof_artists: int = 10,
+        least_amount_listens: int = 15,
+    ) -> WrappedStats:
+        """All numbers of the report for the selected period, without drawing."""
+        self.__make_daily_cube()
+        skip_rates = devices = None
+        if self._extended:
+            skip_rates = self.song_skip_rates(least_amount_listens)
+            skip_rates = pd.DataFrame(
+                {
+                    "plays": skip_rates["total"],
+                    "skips": skip_rates[True],
+                    "percent_skipped": skip_rates["percent_skipped"],
+                }
             )
-        ]
-
-        top_artists_daily = (
-            top_artists_full.groupby(["artistName"]).resample("D", on="endTime").count()
+            devices = self.device_play_time().to_frame()
+
+        return WrappedStats(
+            start=self.__start_date,
+            end=self.__end_date - timedelta(days=1),
+            plays=int(self._daily["playCount"].sum()),
+            ms_played=int(self._daily["msPlayed"].sum()),
+            top_songs=self.rank_songs(nrof_songs)[["playCount", "msPlayed"]],
+            top_artists=self.rank_artists(nrof_artists)[["playCount", "msPlayed"]],
+            hours=self.hourly_play_time().rename_axis("hour").to_frame("msPlayed"),
+            weekdays=self.weekday_play_time()
+            .rename_axis("weekday")
+            .to_frame("msPlayed"),
+            daily=self.daily_play_time().rename_axis("day").to_frame("msPlayed"),
+            skip_rates=skip_rates,
+            devices=devices,
         )
-        top_artists_daily["playCount"] = top_artists_daily["artistName"]
-        top_artists_daily = top_artists_daily.drop(
-            ["artistName", "trackName", "msPlayed"], axis=1
-        )
-
-        plt.figure(figsize=(16, 9))
 
-        for artist in reversed(self._top_artists.index):
-            song_data = top_artists_daily.query(f"artistName == @artist").reset_index()
-            song_data["rolling_playcount"] = (
-                song_data["playCount"].rolling(window=rolling_window).mean()
+    @spanned
+    def cohort_summary(
+        self,
+        capacity: int = 1000,
+        sketch_width: int = 2**14,
+        sketch_depth: int = 4,
+    ) -> CohortSummary:
+        """Summary of the selected period that merges with other users' summaries.
+
+        Keeps the exact hour, weekday and device histograms, the capacity most
+        played songs and artists and Count-Min sketches of the play counts of
+        all of them, see sketches.py.
+        """
+        self.__make_rankings()
+        song_counts = self._song_ranking.totals["playCount"]
+        songs = self._song_ranking.top(len(song_counts))
+        song_names = self._songs.loc[songs, ["artistName", "trackName"]]
+        song_plays = dict(
+            zip(
+                song_names.itertuples(index=False, name=None),
+                song_counts[songs].tolist(),
             )
-            plt.plot(
-                song_data["endTime"], song_data["rolling_playcount"], label=f"{artist}"
+        )
+        artist_counts = self._artist_ranking.totals["playCount"]
+        artists = self._artist_ranking.top(len(artist_counts))
+        artist_plays = dict(
+            zip(
+                self.__artist_names[artists],
+                artist_counts[artists].tolist(),
             )
-
-        plt.title(
-            f"Top {nrof_artists} artists listening time rolling {rolling_window} day average",
-            fontsize=20,
         )
 
-        plt.legend(fontsize=15)
-        plt.xlabel("Date", fontsize=15)
-        plt.ylabel("Play Count", fontsize=15)
-        plt.grid()
-
-        plt.yticks(fontsize=15)
-        plt.xticks(fontsize=15)
+        song_sketch = CountMinSketch(sketch_width, sketch_depth)
+        for song, plays in song_plays.items():
+            song_sketch.update(song, plays)
+        artist_sketch = CountMinSketch(sketch_width, sketch_depth)
+        for artist, plays in artist_plays.items():
+            artist_sketch.update(artist, plays)
 
-        plt.tight_layout()
-        self._pdf_pages.savefig()
+        devices = {}
+        if self._extended:
+            devices = {
+                device: ms
+                for device, ms in self.device_play_time().astype(int).items()
+                if ms > 0
+            }
+        return CohortSummary(
+            users=1,
+            plays=int(self._daily["playCount"].sum()),
+            ms_played=int(self._daily["msPlayed"].sum()),
+            hours=self.hourly_play_time().to_numpy(dtype="int64"),
+            weekdays=self.weekday_play_time().to_numpy(dtype="int64"),
+            devices=devices,
+            songs=SpaceSaving.from_counts(song_plays, capacity),
+            artists=SpaceSaving.from_counts(artist_plays, capacity),
+            song_sketch=song_sketch,
+            artist_sketch=artist_sketch,
+        )
 
+    @spanned
     def play_time_chart(self, rolling_window: int = 31):
 
-        playtime = self._df.resample("D", on="endTime")["msPlayed"].sum()
+        playtime = self.daily_play_time()
 
         # Convert to hours
         playtime = playtime.divide(3600000)
 
         playtime = playtime.rolling(window=rolling_window).mean()
 
-        plt.figure(figsize=(16, 9))
-        plt.plot(playtime)
-
-        plt.title(
-            f"Total playtime rolling {rolling_window} day average",
-            fontsize=20,
+        self._pages.append(
+            Page(
+                "lines",
+                title=f"Total playtime rolling {rolling_window} day average",
+                xlabel="Date",
+                ylabel="Play Time (h)",
+                lines=self.__downsampled(
+                    [(playtime.index.to_numpy(), playtime.to_numpy(), None)]
+                ),
+                grid=True,
+            )
         )
-        plt.xlabel("Date", fontsize=15)
-        plt.ylabel("Play Time (h)", fontsize=15)
-
-        plt.yticks(fontsize=15)
-        plt.xticks(fontsize=15)
-
-        plt.grid()
 
-        plt.tight_layout()
-        self._pdf_pages.savefig()
+    def __downsampled(self, lines: list) -> list:
+        """lines cut down to at most chart_point_budget points together, see downsample."""
+        if self._chart_point_budget is None or not lines:
+            return lines
+        per_line = max(self._chart_point_budget // len(lines), 4)
+        return [(*downsample(x, y, per_line), label) for x, y, label in lines]
+
+    @staticmethod
+    def __percent_annotations(percentages) -> list:
+        """Percent labels of the bars, left out for bars of 1% or less."""
+        return [
+            (index, value / 2, f"{round(value, 2)}%" if value > 1 else "", "center")
+            for index, value in enumerate(percentages)
+        ]
 
+    @spanned
     def play_time_per_hour_in_day(self):
 
-        ms_per_hour = self._df.copy()
-        ms_per_hour["hours"] = self._df["endTime"].dt.hour
-        ms_per_hour = ms_per_hour.groupby("hours")["msPlayed"].sum()
-        ms_per_hour = ms_per_hour.reindex(range(24), fill_value=0)
+        ms_per_hour = self.hourly_play_time()
         total_listening_time = ms_per_hour.sum()
         percent_occurrences_per_hour = (ms_per_hour / total_listening_time) * 100
 
-        plt.figure(figsize=(16, 9))
-        plt.bar(range(24), percent_occurrences_per_hour, color="skyblue")
-        for index, value in enumerate(percent_occurrences_per_hour):
-            formatedValue = ""
-            if value > 1:
-                formatedValue = f"{round(value, 2)}%"
-            plt.text(
-                index,
-                value / 2,
-                formatedValue,
-                ha="center",
-                va="center",
-                fontsize=15,
-                rotation=90,
+        self._pages.append(
+            Page(
+                "bar",
+                title="Listening spread per hour of the day",
+                xlabel="Hour of the Day",
+                ylabel="Percent of listening time",
+                labels=list(range(24)),
+                values=list(percent_occurrences_per_hour),
+                annotations=self.__percent_annotations(percent_occurrences_per_hour),
+                annotation_rotation=90,
             )
+        )
 
-        plt.title("Listening spread per hour of the day", fontsize=20)
-        plt.xlabel("Hour of the Day", fontsize=15)
-        plt.ylabel("Percent of listening time", fontsize=15)
-
-        plt.yticks(fontsize=15)
-        plt.xticks(fontsize=15)
-        plt.xticks(rotation=0)
-
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-
+    @spanned
     def play_time_per_weekday(self):
-        listen_time_weekday = self._df.copy()
-        listen_time_weekday["weekday"] = self._df["endTime"].dt.weekday
-        listen_time_weekday = listen_time_weekday.groupby("weekday")["msPlayed"].sum()
-        listen_time_weekday = listen_time_weekday.reindex(range(7), fill_value=0)
+        listen_time_weekday = self.weekday_play_time()
 
         total_listening_time = listen_time_weekday.sum()
         percent_occurrences_per_hour = (
             listen_time_weekday / total_listening_time
         ) * 100
 
-        plt.figure(figsize=(16, 9))
-        plt.bar(range(7), percent_occurrences_per_hour, color="skyblue")
-        for index, value in enumerate(percent_occurrences_per_hour):
-            formatedValue = ""
-            if value > 1:
-                formatedValue = f"{round(value, 2)}%"
-            plt.text(
-                index,
-                value / 2,
-                formatedValue,
-                ha="center",
-                va="center",
-                fontsize=15,
-                rotation=90,
+        self._pages.append(
+            Page(
+                "bar",
+                title="Percent of listening time per weekday",
+                xlabel="Days",
+                ylabel="Percent of total listening time",
+                labels=list(range(7)),
+                values=list(percent_occurrences_per_hour),
+                annotations=self.__percent_annotations(percent_occurrences_per_hour),
+                annotation_rotation=90,
+                xticks=(
+                    [0, 1, 2, 3, 4, 5, 6],
+                    [
+                        "Monday",
+                        "Tuesday",
+                        "Wednesday",
+                        "Thursday",
+                        "Friday",
+                        "Saturday",
+                        "Sunday",
+                    ],
+                    45,
+                ),
             )
-
-        plt.title("Percent of listening time per weekday", fontsize=20)
-        plt.xlabel("Days", fontsize=15)
-        plt.ylabel("Percent of total listening time", fontsize=15)
-
-        plt.xticks(
-            fontsize=15,
-            ticks=[0, 1, 2, 3, 4, 5, 6],
-            rotation=45,
-            labels=[
-                "Monday",
-                "Tuesday",
-                "Wednesday",
-                "Thursday",
-                "Friday",
-                "Saturday",
-                "Sunday",
-            ],
         )
-        plt.yticks(fontsize=15)
-
-        plt.tight_layout()
-        self._pdf_pages.savefig()
 
+    @spanned
     def song_skip_stats(self, nrof_songs: int = 10, least_amount_listens: int = 15):
         if not self._extended:
             print(
@@ -414,19 +664,7 @@ class WrappedMaker:
             )
             return
 
-        grouped = (
-            self._df.groupby(["artistName", "trackName", "skipped"])
-            .size()
-            .unstack(fill_value=0)
-        )
-
-        grouped = grouped.reindex(columns=[False, True], fill_value=0)
-
-        grouped["total"] = grouped[True] + grouped[False]
-
-        grouped = grouped[grouped["total"] >= least_amount_listens]
-
-        grouped["percent_skipped"] = (grouped[True] / grouped["total"]) * 100
+        grouped = self.song_skip_rates(least_amount_listens)
 
         mostSkipped = (
             grouped[["percent_skipped", "total"]]
@@ -435,34 +673,21 @@ class WrappedMaker:
         )
         mostSkipped = mostSkipped.iloc[::-1]
 
-        plt.figure(figsize=(16, 9))
-        plt.barh(
-            [str(i[0]) + " - " + str(i[1]) for i in mostSkipped.index],
-            mostSkipped["percent_skipped"],
-            color="skyblue",
-        )
-        for index, value in enumerate(mostSkipped["percent_skipped"]):
-            plt.text(
-                x=value / 2,
-                y=index,
-                s=f"{round(value)}%",
-                ha="center",
-                va="center",
-                fontsize=15,
+        self._pages.append(
+            Page(
+                "barh",
+                title=f"Most skipped songs by percentage over {least_amount_listens} listens",
+                xlabel="Percent Skipped",
+                ylabel="Song",
+                labels=[str(i[0]) + " - " + str(i[1]) for i in mostSkipped.index],
+                values=list(mostSkipped["percent_skipped"]),
+                annotations=[
+                    (value / 2, index, f"{round(value)}%", "center")
+                    for index, value in enumerate(mostSkipped["percent_skipped"])
+                ],
             )
-
-        plt.xlabel("Percent Skipped", fontsize=15)
-        plt.ylabel("Song", fontsize=15, rotation=90)
-        plt.xticks(fontsize=15)
-        plt.yticks(fontsize=15)
-        plt.title(
-            f"Most skipped songs by percentage over {least_amount_listens} listens",
-            fontsize=20,
         )
 
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-
         leastSkipped = (
             grouped[["percent_skipped", "total"]]
             .sort_values(by=["percent_skipped", "total"], ascending=[True, False])
@@ -470,56 +695,39 @@ class WrappedMaker:
             .sort_values(by=["percent_skipped", "total"], ascending=[False, True])
         )
 
-        plt.figure(figsize=(16, 9))
-        plt.barh(
-            [str(i[0]) + " - " + str(i[1]) for i in leastSkipped.index],
-            leastSkipped["total"],
-            color="skyblue",
-        )
         max_listen = leastSkipped["total"].max()
-        for index, row in enumerate(leastSkipped.iterrows()):
-            value = row[1]
-            if value["total"] < max_listen / 4:
-                continue
-            plt.text(
-                x=value["total"] / 2,
-                y=index,
-                s=f"Listens: {int(value['total'])}, skip rate: {round(value['percent_skipped'])}%",
-                ha="center",
-                va="center",
-                fontsize=15,
+        self._pages.append(
+            Page(
+                "barh",
+                title=f"Least skipped songs by percentage over {15} listens",
+                xlabel="Total listens",
+                ylabel="Song",
+                labels=[str(i[0]) + " - " + str(i[1]) for i in leastSkipped.index],
+                values=list(leastSkipped["total"]),
+                annotations=[
+                    (
+                        value["total"] / 2,
+                        index,
+                        f"Listens: {int(value['total'])}, skip rate: {round(value['percent_skipped'])}%",
+                        "center",
+                    )
+                    for index, (_, value) in enumerate(leastSkipped.iterrows())
+                    if value["total"] >= max_listen / 4
+                ],
             )
-        plt.xlabel("Total listens", fontsize=15)
-        plt.ylabel("Song", fontsize=15, rotation=90)
-        plt.xticks(fontsize=15)
-        plt.yticks(fontsize=15)
-        plt.title(f"Least skipped songs by percentage over {15} listens", fontsize=20)
-
-        plt.tight_layout()
-        self._pdf_pages.savefig()
+        )
 
+    @spanned
     def least_skipped_top_songs(self, nrof_songs: int = 10):
         if not self._extended:
             print(
                 "-- WARNING -- \nCan not do 'least_skipped_top_songs' due to list not being purely extended entries"
             )
             return
-        self.__make_top_songs(nrof_songs)
-
-        top_songs_entries = self._df[
-            self._df.set_index(["artistName", "trackName"]).index.isin(
-                self._top_songs.head(nrof_songs).index
-            )
-        ]
-
-        grouped = (
-            top_songs_entries.groupby(["artistName", "trackName", "skipped"])
-            .size()
-            .unstack(fill_value=0)
-            .head(nrof_songs)
-        )
+        top_songs_df = self.rank_songs(nrof_songs)
 
-        grouped = grouped.reindex(columns=[False, True], fill_value=0)
+        songs = self.__key_totals("song")
+        grouped = self.__song_skips(songs[songs["song"].isin(top_songs_df["song"])])
 
         grouped["total"] = grouped[True] + grouped[False]
 
@@ -527,13 +735,8 @@ class WrappedMaker:
 
         grouped.sort_values(by="percent_skipped", inplace=True, ascending=False)
 
-        plt.figure(figsize=(16, 9))
-        plt.barh(
-            [str(i[0]) + " - " + str(i[1]) for i in grouped.index],
-            grouped["percent_skipped"],
-            color="skyblue",
-        )
         max_skip_percent = grouped["percent_skipped"].max()
+        annotations = []
         for index, row in enumerate(grouped.iterrows()):
             value = row[1]
             x_loc = value["percent_skipped"] / 2
@@ -541,162 +744,113 @@ class WrappedMaker:
             if value["percent_skipped"] < max_skip_percent / 4:
                 x_loc = value["percent_skipped"]
                 x_align = "left"
-            plt.text(
-                x=x_loc,
-                y=index,
-                s=f"Listens: {int(value['total'])}, skip rate: {round(value['percent_skipped'])}%",
-                ha=x_align,
-                va="center",
-                fontsize=15,
+            annotations.append(
+                (
+                    x_loc,
+                    index,
+                    f"Listens: {int(value['total'])}, skip rate: {round(value['percent_skipped'])}%",
+                    x_align,
+                )
             )
 
-        plt.xlabel("Percent skipped", fontsize=15)
-        plt.ylabel("Song", fontsize=15, rotation=90)
-        plt.xticks(fontsize=15)
-        plt.yticks(fontsize=15)
-        plt.title(
-            f"Top {min(nrof_songs, self._top_songs.shape[0])} least skipped top songs skip rate",
-            fontsize=20,
+        self._pages.append(
+            Page(
+                "barh",
+                title=f"Top {top_songs_df.shape[0]} least skipped top songs skip rate",
+                xlabel="Percent skipped",
+                ylabel="Song",
+                labels=[str(i[0]) + " - " + str(i[1]) for i in grouped.index],
+                values=list(grouped["percent_skipped"]),
+                annotations=annotations,
+            )
         )
 
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-
+    @spanned
     def device_listening_time(self):
         if not self._extended:
             print(
                 "-- WARNING -- \nCan not do 'device_listening_time' due to list not being purely extended entries"
             )
             return
-        listen_time_per_device = self._df.groupby("platform")["msPlayed"].sum()
-
-        # Define partial string matches and their corresponding labels
-        partial_strings = {
-            "Windows": "Windows",
-            "Linux": "Linux",
-            r"ps5|ps4|ps3|ps2|playstation": "PlayStation",
-            "Android": "Android",
-            r"ios": "iOS",
-            r"osx": "MacOS",
-        }
-
-        # Split the DataFrame based on partial string matches and calculate the sum of msPlayed for each group
-        platforms = [
-            (
-                label,
-                listen_time_per_device[
-                    listen_time_per_device.index.str.contains(partial, case=False)
-                ].sum()
-                / 3600000,
-            )
-            for partial, label in partial_strings.items()
-        ]
-
-        # Calculate the total listening time for all platforms
-        total_listening_time = listen_time_per_device.sum() / 3600000
-
-        # Calculate the sum of the listed platforms
-        listed_platforms_sum = sum([x[1] for x in platforms])
-
-        # Calculate the listening time for the "Other" category
-        other_listening_time = total_listening_time - listed_platforms_sum
-        platforms.append(("Other", other_listening_time))
+        listen_time_per_device = self.device_play_time() / 3600000
 
-        # Sort the platforms list by the second element of each tuple in descending order
-        platforms.sort(key=lambda x: x[1], reverse=True)
-
-        plt.figure(figsize=(16, 9))
-        plt.barh(
-            [i[0] for i in platforms],
-            [i[1] for i in platforms],
-            color="skyblue",
+        # Sort the devices by listening time in descending order
+        platforms = sorted(
+            listen_time_per_device.items(), key=lambda x: x[1], reverse=True
         )
-        for index, value in enumerate([i[1] for i in platforms]):
-            if value < max(platforms, key=lambda x: x[1])[1] / 10:
-                continue
-            plt.text(
-                x=value / 2,
-                y=index,
-                s=f"{round(value)}",
-                ha="center",
-                va="center",
-                fontsize=15,
+        max_listening_time = platforms[0][1]
+
+        self._pages.append(
+            Page(
+                "barh",
+                title="Listening time per device",
+                xlabel="Listening time (hours)",
+                ylabel="Device",
+                labels=[i[0] for i in platforms],
+                values=[i[1] for i in platforms],
+                annotations=[
+                    (value / 2, index, f"{round(value)}", "center")
+                    for index, (_, value) in enumerate(platforms)
+                    if value >= max_listening_time / 10
+                ],
             )
-
-        plt.xlabel("Listening time (hours)", fontsize=15)
-        plt.ylabel("Device", fontsize=15, rotation=90)
-        plt.xticks(fontsize=15)
-        plt.yticks(fontsize=15)
-        plt.title(
-            f"Listening time per device",
-            fontsize=20,
         )
 
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-        plt.close()
-
+    @spanned
     def device_listening_chart(self, rolling_window: int = 31):
         if not self._extended:
             print(
                 "-- WARNING -- \nCan not do 'device_listening_chart' due to list not being purely extended entries"
             )
             return
-        # Group by platform and resample by day, summing the msPlayed for each day
-        listen_time_per_device = (
-            self._df.groupby(["platform", pd.Grouper(key="endTime", freq="D")])[
-                "msPlayed"
-            ]
-            .sum()
-            .reset_index()
+        self.__make_daily_cube()
+        # "Other" is left out of the chart
+        categories = self._history["device"].cat.categories
+        codes = [code for code, name in enumerate(categories) if name != "Other"]
+        devices = categories[codes]
+
+        # One column of daily listening time per device, each device's line runs
+        # from its first to its last day of use in the period
+        days, listen_time_per_device = daily_matrix(
+            self._daily, "device", codes, value="msPlayed"
         )
-
-        # Define partial string matches and their corresponding labels
-        partial_strings = {
-            "Windows": "Windows",
-            "Linux": "Linux",
-            r"ps5|ps4|ps3|ps2|playstation": "PlayStation",
-            "Android": "Android",
-            r"ios": "iOS",
-            r"osx": "macOS",
-        }
-
-        plt.figure(figsize=(16, 9))
-
-        # Plot each device over the entire time with rolling mean
-        for partial, label in partial_strings.items():
-            platform_data = listen_time_per_device[
-                listen_time_per_device["platform"].str.contains(partial, case=False)
-            ].copy()
-
-            # Ensure the data is continuous by reindexing and filling missing values
-            platform_data.set_index("endTime", inplace=True)
-            platform_data = platform_data.resample("D").sum().fillna(0).reset_index()
-
-            # Calculate the rolling mean
-            platform_data["rolling_mean"] = (
-                platform_data["msPlayed"].rolling(window=rolling_window).mean()
+        first, last = active_spans(listen_time_per_device)
+        rolling_means = rolling_mean(listen_time_per_device, rolling_window, first)
+
+        lines = []
+        # Without plays on any of the devices in the period no lines are drawn
+        for i, label in enumerate(devices if len(days) else []):
+            if not listen_time_per_device[:, i].any():
+                lines.append(([], [], label))
+                continue
+            lines.append(
+                (
+                    days[first[i] : last[i] + 1].to_numpy(),
+                    rolling_means[first[i] : last[i] + 1, i] / 3600000,
+                    label,
+                )
             )
 
-            # Plot the data
-            plt.plot(
-                platform_data["endTime"],
-                platform_data["rolling_mean"] / 3600000,
-                label=label,
+        self._pages.append(
+            Page(
+                "lines",
+                title=f"Listening time per device rolling {rolling_window} day average",
+                xlabel="Date",
+                ylabel="Listening Time (hours) per day",
+                lines=self.__downsampled(lines),
+                legend_fontsize=20,
             )
-
-        plt.legend(fontsize=20)
-        plt.xlabel("Date", fontsize=15)
-        plt.ylabel("Listening Time (hours) per day", fontsize=15)
-        plt.title(
-            f"Listening time per device rolling {rolling_window} day average",
-            fontsize=20,
         )
-        plt.xticks(fontsize=15)
-        plt.yticks(fontsize=15)
-        plt.tight_layout()
-        self._pdf_pages.savefig()
-        plt.close()
 
+    @spanned
     def write_to_file(self) -> None:
-        self._pdf_pages.close()
+        """Draw the pages added since open_pdf into the pdf."""
+        write_pdf(
+            self._pages,
+            self._pdf_path,
+            self._render_workers,
+            self._font_families,
+            self.profiler,
+            self._page_cache_dir,
+        )
+        self._pages = []
@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+import functools
+from pathlib import Path
+
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_resident_memory() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+class Span(dict):
+    """One timed stage, a dict of its measurements.
+
+    Extra values, like the rows the stage worked on, are set as items while
+    the span is open.
+    """
+
+    def __init__(self, profiler: "Profiler", name: str, depth: int):
+        super().__init__(name=name, depth=depth)
+        self._profiler = profiler
+
+    def __enter__(self) -> "Span":
+        self._profiler._depth += 1
+        self._peak = peak_resident_memory()
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall = time.perf_counter()
+        self["start"] = self._wall - self._profiler.start
+        self["wall"] = wall - self._wall
+        self["cpu"] = time.process_time() - self._cpu
+        self["peak_memory_delta"] = peak_resident_memory() - self._peak
+        self._profiler._depth -= 1
+        self._profiler.spans.append(self)
+
+
+class _NoSpan:
+    """Span of a disabled profiler, measures and keeps nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __setitem__(self, key, value) -> None:
+        pass
+
+
+class Profiler:
+    """Records named spans of wall time, CPU time, peak memory growth and rows.
+
+    with profiler.span("normalize") as span:
+        ...
+        span["rows"] = df.shape[0]
+
+    Spans can be nested, depth counts the spans open around one. The peak
+    memory delta is how much the peak resident memory of the process grew
+    during the span, so a stage staying below an earlier peak shows 0.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.spans = []
+        self.start = time.perf_counter()
+        self._depth = 0
+
+    def span(self, name: str) -> Span:
+        return Span(self, name, self._depth)
+
+    def to_dict(self) -> list[dict]:
+        """The finished spans in the order they were started."""
+        return sorted((dict(span) for span in self.spans), key=lambda s: s["start"])
+
+    def to_json(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=1))
+
+    def to_chrome_trace(self, path: Path) -> None:
+        """Write the spans in the Chrome trace event format, for chrome://tracing or Perfetto."""
+        pid, tid = os.getpid(), threading.get_ident()
+        events = [
+            {
+                "name": span["name"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["wall"] * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": {
+                    key: value
+                    for key, value in span.items()
+                    if key not in ("name", "start", "wall", "depth")
+                },
+            }
+            for span in self.to_dict()
+        ]
+        Path(path).write_text(json.dumps({"traceEvents": events}))
+
+    def hot_spots(self, count: int = 5) -> list[dict]:
+        """The count innermost spans taking the most wall time."""
+        inner = [
+            span
+            for span in self.to_dict()
+            if not any(
+                other["depth"] > span["depth"]
+                and span["start"] <= other["start"] < span["start"] + span["wall"]
+                for other in self.spans
+            )
+        ]
+        return sorted(inner, key=lambda span: span["wall"], reverse=True)[:count]
+
+
+class NoProfiler:
+    """Stands in for a Profiler when profiling is off, at the cost of a method call."""
+
+    enabled = False
+    _span = _NoSpan()
+
+    def span(self, name: str) -> _NoSpan:
+        return self._span
+
+
+NO_PROFILER = NoProfiler()
+
+
+def spanned(method):
+    """Run a method in a span named after it, on the profiler of its object."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.profiler.span(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,310 @@
+import io
+import hashlib
+import functools
+from pathlib import Path
+from itertools import repeat
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+
+from profiling import NO_PROFILER
+
+# matplotlib and pypdf are imported on first use, so importing this module (and
+# parser) stays cheap for runs that draw nothing. Pages are drawn on Figure
+# objects without pyplot, so no backend is picked and no figure outlives its page
+
+# Fonts tried in order for every character, the CJK fonts make Japanese, Chinese
+# and Korean titles and names render. Families that are not installed are skipped
+FONT_FAMILIES = (
+    "Meiryo",
+    "Yu Gothic",
+    "Hiragino Sans",
+    "Noto Sans CJK JP",
+    "IPAexGothic",
+    "DejaVu Sans",
+)
+
+
+@functools.cache
+def installed_fonts(font_families: tuple[str, ...]) -> list[str]:
+    """The families of font_families that are installed, in the same order.
+
+    Resolved once per process, so matplotlib never searches for missing
+    families or warns about them while drawing.
+    """
+    from matplotlib import font_manager
+
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    return [family for family in font_families if family in installed] or [
+        "DejaVu Sans"
+    ]
+
+
+def font_settings(font_families: tuple[str, ...] = FONT_FAMILIES) -> dict:
+    """rc settings drawing with the installed ones of font_families."""
+    return {"font.family": installed_fonts(tuple(font_families))}
+
+
+@dataclass
+class Page:
+    """The data and plot settings of one report page.
+
+    kind is one of
+    "text": title and text centered on an empty page
+    "barh": horizontal bars, labels and values give the bars from the bottom up
+    "bar": vertical bars at the positions in labels
+    "lines": one line per (x, y, label) in lines
+    annotations are drawn on top of the bars as (x, y, text, horizontal alignment).
+    """
+
+    kind: str
+    title: str = ""
+    text: str = ""
+    xlabel: str = ""
+    ylabel: str = ""
+    labels: list = field(default_factory=list)
+    values: list = field(default_factory=list)
+    annotations: list = field(default_factory=list)
+    annotation_rotation: float = 0
+    lines: list = field(default_factory=list)
+    # Font size of the legend, None draws no legend
+    legend_fontsize: int = None
+    grid: bool = False
+    # Custom x ticks as (positions, labels, rotation)
+    xticks: tuple = None
+
+
+def draw_page(page: Page) -> "Figure":
+    """Draw page on a new figure.
+
+    The figure is not registered with pyplot, nothing but the caller holds on
+    to it. Has to be called inside matplotlib.rc_context(font_settings(...)).
+    """
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(16, 9))
+    ax = fig.add_subplot()
+
+    if page.kind == "text":
+        ax.text(0.5, 0.95, page.title, fontsize=30, ha="center", va="top")
+        ax.text(0.5, 0.85, page.text, fontsize=20, ha="center", va="top")
+        ax.axis("off")  # Hide axes
+        return fig
+
+    if page.kind == "barh":
+        ax.barh(page.labels, page.values, color="skyblue")
+    elif page.kind == "bar":
+        ax.bar(page.labels, page.values, color="skyblue")
+    elif page.kind == "lines":
+        for x, y, label in page.lines:
+            ax.plot(x, y, label=label)
+
+    for x, y, text, ha in page.annotations:
+        ax.text(
+            x=x,
+            y=y,
+            s=text,
+            ha=ha,
+            va="center",
+            fontsize=15,
+            rotation=page.annotation_rotation,
+        )
+
+    # A chart of a period without plays has no lines to put in a legend
+    if page.legend_fontsize is not None and page.lines:
+        ax.legend(fontsize=page.legend_fontsize)
+    ax.set_title(page.title, fontsize=20)
+    ax.set_xlabel(page.xlabel, fontsize=15)
+    ax.set_ylabel(page.ylabel, fontsize=15)
+    if page.grid:
+        ax.grid()
+
+    ax.tick_params(labelsize=15)
+    if page.xticks is not None:
+        ticks, labels, rotation = page.xticks
+        ax.set_xticks(ticks, labels=labels, rotation=rotation)
+
+    fig.tight_layout()
+    return fig
+
+
+def save_page(
+    page: Page,
+    file,
+    font_families: tuple[str, ...],
+    profiler=NO_PROFILER,
+    **kwargs,
+) -> None:
+    """Draw page and save it to file, releasing the figure afterwards.
+
+    file is a path, a file-like object or a PdfPages, kwargs go to savefig.
+    """
+    import matplotlib
+
+    with matplotlib.rc_context(font_settings(font_families)):
+        # tight_layout is part of drawing, the text is laid out in saving
+        with profiler.span(f"draw {page.kind} '{page.title}'"):
+            fig = draw_page(page)
+        try:
+            with profiler.span(f"save {page.kind} '{page.title}'"):
+                # PdfPages.savefig takes the figure, files go through the figure
+                if hasattr(file, "savefig"):
+                    file.savefig(fig, **kwargs)
+                else:
+                    fig.savefig(file, **kwargs)
+        finally:
+            fig.clear()
+
+
+def render_page(
+    page: Page, font_families: tuple[str, ...] = FONT_FAMILIES, format: str = "pdf"
+) -> bytes:
+    """Draw page as a single page file of format (pdf, png, svg, ...)."""
+    buffer = io.BytesIO()
+    save_page(page, buffer, font_families, format=format)
+    return buffer.getvalue()
+
+
+def page_key(page: Page, font_families: tuple[str, ...]) -> str:
+    """Content address of the drawn page.
+
+    Hashes the page spec (the aggregated numbers and every plot setting), the
+    installed fonts used, this module's code and the matplotlib version, so
+    a cached page is only reused when drawing it again gives the same page.
+    """
+    import pickle
+    import matplotlib
+
+    key = hashlib.sha256()
+    key.update(Path(__file__).read_bytes())
+    key.update(matplotlib.__version__.encode())
+    key.update(repr(installed_fonts(tuple(font_families))).encode())
+    key.update(pickle.dumps(page, protocol=4))
+    return key.hexdigest()
+
+
+def render_cached_pages(
+    pages: list[Page],
+    cache_dir: Path,
+    workers: int,
+    font_families: tuple[str, ...],
+    profiler=NO_PROFILER,
+) -> list[bytes]:
+    """Single page pdfs of pages, drawing only those not in cache_dir yet.
+
+    Pages in cache_dir that are not among pages are removed, so cache_dir
+    only ever holds the pages of the last report written through it.
+    """
+    paths = [cache_dir / f"{page_key(page, font_families)}.pdf" for page in pages]
+    page_pdfs = []
+    for path in paths:
+        # Read right away, a page removed in the meantime is simply drawn again
+        try:
+            page_pdfs.append(path.read_bytes())
+        except FileNotFoundError:
+            page_pdfs.append(None)
+    missing = [index for index, page_pdf in enumerate(page_pdfs) if page_pdf is None]
+
+    with profiler.span("draw uncached pages") as span:
+        span["pages"] = len(missing)
+        if workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as pool:
+                drawn = list(
+                    pool.map(
+                        render_page,
+                        [pages[index] for index in missing],
+                        repeat(font_families),
+                    )
+                )
+        else:
+            drawn = [render_page(pages[index], font_families) for index in missing]
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for stale in set(cache_dir.glob("*.pdf")) - set(paths):
+        stale.unlink()
+    for index, page_pdf in zip(missing, drawn):
+        # Written next to the target and renamed so a crash never leaves a partial page
+        tmp_path = paths[index].with_name(paths[index].name + ".tmp")
+        tmp_path.write_bytes(page_pdf)
+        tmp_path.replace(paths[index])
+        page_pdfs[index] = page_pdf
+    return page_pdfs
+
+
+def merge_pdfs(page_pdfs, pdf_path) -> None:
+    """Write the single page pdfs page_pdfs as one pdf to pdf_path, needs pypdf.
+
+    Each page embeds its own subset of the fonts, objects shared by pages are
+    only kept once (pypdf 4.3 and later), which still leaves the merged pdf
+    somewhat larger than one drawn with PdfPages.
+    """
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for page_pdf in page_pdfs:
+        writer.append(io.BytesIO(page_pdf))
+    if hasattr(writer, "compress_identical_objects"):
+        writer.compress_identical_objects()
+    writer.write(pdf_path)
+
+
+def write_pdf(
+    pages: list[Page],
+    pdf_path,
+    workers: int = 1,
+    font_families: tuple[str, ...] = FONT_FAMILIES,
+    profiler=NO_PROFILER,
+    page_cache_dir: Path = None,
+) -> None:
+    """Draw pages into the pdf at pdf_path (a path or binary file), in order.
+
+    With workers > 1 (and pypdf installed) the pages are drawn in that many
+    processes, each into its own single page pdf, and merged afterwards. The
+    profiler then only sees the pool as a whole. The merged pdf repeats the
+    fonts of every page and is larger, see merge_pdfs. Without pypdf a
+    warning is printed and the pages are drawn in this process.
+    With a page_cache_dir (and pypdf installed) every drawn page is kept there
+    under its page_key and pages drawn before are reused instead of drawn.
+    Each pdf path gets its own folder in page_cache_dir, named after a hash
+    of the resolved path, holding the pages of its last version only. The
+    pages are merged like those of the workers, with the same size cost.
+    """
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        # Without pypdf the pages can not be merged, they are always drawn in
+        # order in this process
+        PdfWriter = None
+
+    if page_cache_dir is not None and PdfWriter is None:
+        print("-- WARNING -- \nCan not cache pages without pypdf, drawing every page")
+    elif page_cache_dir is not None:
+        if isinstance(pdf_path, (str, Path)):
+            resolved = str(Path(pdf_path).resolve())
+            report = hashlib.sha1(resolved.encode()).hexdigest()[:16]
+        else:
+            report = "report"
+        page_pdfs = render_cached_pages(
+            pages, Path(page_cache_dir) / report, workers, font_families, profiler
+        )
+        with profiler.span("merge pages"):
+            merge_pdfs(page_pdfs, pdf_path)
+        return
+
+    if workers > 1 and PdfWriter is None:
+        print(
+            "-- WARNING -- \nCan not draw pages in several processes without pypdf, "
+            "drawing them in this process"
+        )
+    elif workers > 1 and len(pages) > 1:
+        with profiler.span("render pool"):
+            with ProcessPoolExecutor(max_workers=min(workers, len(pages))) as pool:
+                merge_pdfs(
+                    pool.map(render_page, pages, repeat(font_families)), pdf_path
+                )
+        return
+
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    with PdfPages(pdf_path) as pdf_pages:
+        for page in pages:
+            save_page(page, pdf_pages, font_families, profiler)
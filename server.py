@@ -0,0 +1,263 @@
+import io
+import sys
+import asyncio
+import argparse
+import traceback
+from pathlib import Path
+from datetime import date
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+
+import wrappedMaker as wm
+from render import render_page, write_pdf
+
+# Settings
+# Address the service listens on, keep it local
+host = "127.0.0.1"
+port = 8080
+
+# Directory with one export folder or export ZIP per user, as for batch.py
+users_root = Path("./users")
+
+# Memory budget for the loaded histories and their aggregates and for the
+# rendered pages and pdfs, the least recently used are dropped above it
+history_memory_mib = 1024
+artifact_memory_mib = 256
+
+# Processes drawing pages and pdfs
+render_workers = 2
+
+CONTENT_TYPES = {
+    "pdf": "application/pdf",
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LRUCache:
+    """Least recently used cache holding values up to a total size in bytes.
+
+    size gives the bytes of a value. The newest value is always kept, even
+    when it alone is over the budget.
+    """
+
+    def __init__(self, budget: int, size=len):
+        self.budget = budget
+        self.size = size
+        self._items = OrderedDict()
+        self._sizes = {}
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key, value) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        self.resize(key)
+
+    def resize(self, key) -> None:
+        """Measure the value of key again, after it grew, and evict to the budget."""
+        self._sizes[key] = self.size(self._items[key])
+        while sum(self._sizes.values()) > self.budget and len(self._items) > 1:
+            evicted, _ = self._items.popitem(last=False)
+            del self._sizes[evicted]
+
+
+def render_pdf(pages: list, font_families: tuple[str, ...]) -> bytes:
+    """Draw pages as one pdf, run in the render processes."""
+    buffer = io.BytesIO()
+    write_pdf(pages, buffer, font_families=font_families)
+    return buffer.getvalue()
+
+
+class ReportServer:
+    """Serves the report pages and pdfs of the users in root_dir.
+
+    GET /users/<user>/report.pdf
+    GET /users/<user>/pages/<number>.png (or .svg), numbered from 1
+    both take optional start and end days (YYYY-MM-DD) as query parameters.
+    """
+
+    def __init__(self, root_dir: Path, render_pool: ProcessPoolExecutor):
+        self.root_dir = root_dir
+        self.render_pool = render_pool
+        self.makers = LRUCache(
+            history_memory_mib * 2**20, lambda entry: entry[0].memory_usage()
+        )
+        self.artifacts = LRUCache(artifact_memory_mib * 2**20)
+        self._user_locks = {}
+
+    async def wrapped_maker(self, user: str):
+        """The WrappedMaker of user with its page specs per period, loaded once."""
+        entry = self.makers.get(user)
+        if entry is None:
+            # A user is an export folder or an export ZIP named <user>.zip
+            user_dir = self.root_dir / user
+            if not user_dir.is_dir():
+                user_dir = self.root_dir / f"{user}.zip"
+            if user.startswith(".") or not user_dir.exists():
+                raise HttpError(404, f"Unknown user {user}")
+
+            from parser import WrappedMaker
+
+            maker = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: WrappedMaker(
+                    history_src_dir=user_dir,
+                    cache_dir=wm.history_cache_dir,
+                    font_families=wm.font_families,
+                ),
+            )
+            entry = (maker, {})
+            self.makers.put(user, entry)
+        return entry
+
+    async def report_pages(self, user: str, start: date, end: date) -> list:
+        # A WrappedMaker has one selected period, so each user's pages are made
+        # one period at a time
+        lock = self._user_locks.setdefault(user, asyncio.Lock())
+        async with lock:
+            maker, pages = await self.wrapped_maker(user)
+            if (start, end) not in pages:
+
+                def make_pages():
+                    maker.select_period(start, end)
+                    maker.open_pdf(None)
+                    wm.add_report_pages(maker)
+                    return maker.pages
+
+                pages[start, end] = await asyncio.get_running_loop().run_in_executor(
+                    None, make_pages
+                )
+                # The aggregates are built with the first pages
+                self.makers.resize(user)
+        return pages[start, end]
+
+    async def artifact(self, user: str, start: date, end: date, name: str) -> bytes:
+        key = (user, start, end, name)
+        artifact = self.artifacts.get(key)
+        if artifact is not None:
+            return artifact
+
+        pages = await self.report_pages(user, start, end)
+        loop = asyncio.get_running_loop()
+        if name == "report.pdf":
+            artifact = await loop.run_in_executor(
+                self.render_pool, render_pdf, pages, wm.font_families
+            )
+        else:
+            number, _, format = name.partition(".")
+            if not number.isdigit() or not 1 <= int(number) <= len(pages):
+                raise HttpError(404, f"No page {number}, there are {len(pages)}")
+            artifact = await loop.run_in_executor(
+                self.render_pool,
+                render_page,
+                pages[int(number) - 1],
+                wm.font_families,
+                format,
+            )
+        self.artifacts.put(key, artifact)
+        return artifact
+
+    async def respond(self, target: str) -> tuple[bytes, str]:
+        url = urlsplit(target)
+        parts = url.path.strip("/").split("/")
+        query = parse_qs(url.query)
+        try:
+            start = date.fromisoformat(query.get("start", [str(wm.start_date)])[0])
+            end = date.fromisoformat(query.get("end", [str(wm.end_date)])[0])
+        except ValueError as error:
+            raise HttpError(400, str(error))
+
+        if len(parts) == 3 and parts[0] == "users" and parts[2] == "report.pdf":
+            name = "report.pdf"
+        elif (
+            len(parts) == 4
+            and parts[0] == "users"
+            and parts[2] == "pages"
+            and parts[3].rpartition(".")[2] in ("png", "svg")
+        ):
+            name = parts[3]
+        else:
+            raise HttpError(404, f"Unknown path {url.path}")
+
+        body = await self.artifact(parts[1], start, end, name)
+        return body, CONTENT_TYPES[name.rpartition(".")[2]]
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            # Headers are read and ignored
+            while (await reader.readline()).strip():
+                pass
+
+            try:
+                if len(request_line) != 3 or request_line[0] != "GET":
+                    raise HttpError(405, "Only GET is supported")
+                body, content_type = await self.respond(request_line[1])
+                status = 200
+            except HttpError as error:
+                body, content_type, status = (
+                    str(error).encode(),
+                    "text/plain",
+                    error.status,
+                )
+            except Exception:
+                traceback.print_exc()
+                body, content_type, status = b"Internal error", "text/plain", 500
+
+            reasons = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {reasons.get(status, 'Error')}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode()
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(root_dir: Path, host: str, port: int) -> None:
+    with ProcessPoolExecutor(max_workers=render_workers) as render_pool:
+        report_server = ReportServer(root_dir, render_pool)
+        server = await asyncio.start_server(report_server.handle, host, port)
+        print(f"Serving reports of {root_dir} on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Serve Spotify Wrapped pages and pdfs of the users in a directory"
+    )
+    arg_parser.add_argument(
+        "root_dir",
+        type=Path,
+        nargs="?",
+        default=users_root,
+        help="directory with one export folder per user",
+    )
+    arg_parser.add_argument("--host", default=host)
+    arg_parser.add_argument("--port", type=int, default=port)
+    args = arg_parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.root_dir, args.host, args.port))
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,272 @@
+import json
+import zlib
+import base64
+import hashlib
+import numpy as np
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+
+HOURS = 24
+WEEKDAYS = 7
+
+
+class SpaceSaving:
+    """Heavy hitters of a weighted stream, mergeable with other SpaceSavings.
+
+    Keeps at most capacity keys with an upper bound count and the error of that
+    bound, so a key's true weight lies between count - error and count. Keys
+    not kept have a weight of at most floor. Summaries of any split of a
+    stream merge into a summary of the whole with the same guarantees, see
+    merge.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+
+    def update(self, key, weight: int = 1) -> None:
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] = self.counts.get(key, 0) + weight
+            self.errors.setdefault(key, 0)
+            return
+        # The smallest counter is given to the new key, whose weight before
+        # was at most that count
+        smallest = min(self.counts, key=self.counts.get)
+        count = self.counts.pop(smallest)
+        del self.errors[smallest]
+        self.counts[key] = count + weight
+        self.errors[key] = count
+        self.floor = count
+
+    @classmethod
+    def from_counts(cls, counts: dict, capacity: int) -> "SpaceSaving":
+        """Exact summary of known totals, keeping the capacity largest."""
+        summary = cls(capacity)
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        summary.counts = dict(ranked[:capacity])
+        summary.errors = dict.fromkeys(summary.counts, 0)
+        summary.floor = ranked[capacity][1] if len(ranked) > capacity else 0
+        return summary
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """Summary of both streams.
+
+        A key missing from one summary may still have up to its floor there,
+        so that floor is added to both its count and its error.
+        """
+        merged = SpaceSaving(max(self.capacity, other.capacity))
+        counts, errors = {}, {}
+        for key in self.counts.keys() | other.counts.keys():
+            counts[key] = self.counts.get(key, self.floor) + other.counts.get(
+                key, other.floor
+            )
+            errors[key] = self.errors.get(key, self.floor) + other.errors.get(
+                key, other.floor
+            )
+
+        ranked = sorted(counts, key=lambda key: (-counts[key], str(key)))
+        kept = ranked[: merged.capacity]
+        merged.counts = {key: counts[key] for key in kept}
+        merged.errors = {key: errors[key] for key in kept}
+        dropped = counts[ranked[merged.capacity]] if len(ranked) > len(kept) else 0
+        merged.floor = max(self.floor + other.floor, dropped)
+        return merged
+
+    def top(self, k: int) -> list[tuple]:
+        """The k keys with the highest counts as (key, count, error)."""
+        ranked = sorted(self.counts, key=lambda key: (-self.counts[key], str(key)))
+        return [(key, self.counts[key], self.errors[key]) for key in ranked[:k]]
+
+    def to_dict(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "floor": self.floor,
+            "items": [
+                [key, count, self.errors[key]] for key, count in self.counts.items()
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, key_type=tuple) -> "SpaceSaving":
+        summary = cls(data["capacity"])
+        summary.floor = data["floor"]
+        for key, count, error in data["items"]:
+            key = key_type(key)
+            summary.counts[key] = count
+            summary.errors[key] = error
+        return summary
+
+
+class CountMinSketch:
+    """Estimated weight of any key, never below the true weight.
+
+    Each key is hashed to one counter per row, the estimate is the smallest
+    of its counters. Sketches of the same width and depth merge by adding
+    their counters. Keys are hashed with blake2b, so sketches made in other
+    processes or runs agree.
+    """
+
+    def __init__(self, width: int = 2**14, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _columns(self, key) -> np.ndarray:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=8 * self.depth)
+        return np.frombuffer(digest.digest(), dtype=np.uint64) % self.width
+
+    def update(self, key, weight: int = 1) -> None:
+        self.table[np.arange(self.depth), self._columns(key)] += weight
+
+    def estimate(self, key) -> int:
+        return int(self.table[np.arange(self.depth), self._columns(key)].min())
+
+    def merge(self, other: "CountMinSketch") -> "CountMinSketch":
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min sketches of different sizes can not be merged")
+        merged = CountMinSketch(self.width, self.depth)
+        merged.table = self.table + other.table
+        return merged
+
+    def to_dict(self) -> dict:
+        # The table of one user is mostly zeros and compresses well
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "table": base64.b64encode(zlib.compress(self.table.tobytes())).decode(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CountMinSketch":
+        sketch = cls(data["width"], data["depth"])
+        sketch.table = (
+            np.frombuffer(
+                zlib.decompress(base64.b64decode(data["table"])), dtype=np.int64
+            )
+            .reshape(sketch.depth, sketch.width)
+            .copy()
+        )
+        return sketch
+
+
+@dataclass
+class CohortSummary:
+    """Mergeable summary of the listening of one or more users.
+
+    The totals and the hour, weekday and device histograms (ms played) are
+    exact. Songs ((artist, track) keys) and artists are summarized by play
+    count in a SpaceSaving of the heaviest and a CountMinSketch of all.
+    """
+
+    users: int = 0
+    plays: int = 0
+    ms_played: int = 0
+    hours: np.ndarray = field(default_factory=lambda: np.zeros(HOURS, np.int64))
+    weekdays: np.ndarray = field(default_factory=lambda: np.zeros(WEEKDAYS, np.int64))
+    devices: dict = field(default_factory=dict)
+    songs: SpaceSaving = None
+    artists: SpaceSaving = None
+    song_sketch: CountMinSketch = None
+    artist_sketch: CountMinSketch = None
+
+    def merge(self, other: "CohortSummary") -> "CohortSummary":
+        return CohortSummary(
+            users=self.users + other.users,
+            plays=self.plays + other.plays,
+            ms_played=self.ms_played + other.ms_played,
+            hours=self.hours + other.hours,
+            weekdays=self.weekdays + other.weekdays,
+            devices={
+                device: self.devices.get(device, 0) + other.devices.get(device, 0)
+                for device in self.devices | other.devices
+            },
+            songs=self.songs.merge(other.songs),
+            artists=self.artists.merge(other.artists),
+            song_sketch=self.song_sketch.merge(other.song_sketch),
+            artist_sketch=self.artist_sketch.merge(other.artist_sketch),
+        )
+
+    @staticmethod
+    def _top(summary: SpaceSaving, sketch: CountMinSketch, k: int) -> list[tuple]:
+        # Both counts are upper bounds of the true play count, the lower wins.
+        # Every kept key is ranked by it, as merging can inflate the counts of
+        # SpaceSaving more than the sketch
+        estimates = [
+            (key, min(count, sketch.estimate(key)), max(count - error, 0))
+            for key, count, error in summary.top(len(summary.counts))
+        ]
+        estimates.sort(key=lambda item: (-item[1], -item[2], str(item[0])))
+        return estimates[:k]
+
+    def top_songs(self, k: int = 10) -> list[tuple]:
+        """The k most played songs as ((artist, track), estimate, lower bound)."""
+        return self._top(self.songs, self.song_sketch, k)
+
+    def top_artists(self, k: int = 10) -> list[tuple]:
+        """The k most played artists as (artist, estimate, lower bound)."""
+        return self._top(self.artists, self.artist_sketch, k)
+
+    def to_dict(self) -> dict:
+        return {
+            "users": self.users,
+            "plays": self.plays,
+            "ms_played": self.ms_played,
+            "hours": self.hours.tolist(),
+            "weekdays": self.weekdays.tolist(),
+            "devices": self.devices,
+            "songs": self.songs.to_dict(),
+            "artists": self.artists.to_dict(),
+            "song_sketch": self.song_sketch.to_dict(),
+            "artist_sketch": self.artist_sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CohortSummary":
+        return cls(
+            users=data["users"],
+            plays=data["plays"],
+            ms_played=data["ms_played"],
+            hours=np.array(data["hours"], dtype=np.int64),
+            weekdays=np.array(data["weekdays"], dtype=np.int64),
+            devices=data["devices"],
+            songs=SpaceSaving.from_dict(data["songs"], tuple),
+            artists=SpaceSaving.from_dict(data["artists"], str),
+            song_sketch=CountMinSketch.from_dict(data["song_sketch"]),
+            artist_sketch=CountMinSketch.from_dict(data["artist_sketch"]),
+        )
+
+    def to_json(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), ensure_ascii=False))
+
+    @classmethod
+    def from_json(cls, path: Path) -> "CohortSummary":
+        return cls.from_dict(json.loads(Path(path).read_text()))
+
+
+def merge_pair(pair: tuple) -> CohortSummary:
+    first, second = pair
+    return first if second is None else first.merge(second)
+
+
+def merge_tree(summaries: list[CohortSummary], nrof_workers: int = 1) -> CohortSummary:
+    """Merge summaries pairwise, level by level, each level in a process pool.
+
+    Each merge only needs its two summaries, never the plays behind them, and
+    a level of n summaries leaves n / 2 for the next.
+    """
+    if not summaries:
+        raise ValueError("No summaries to merge")
+    pool = ProcessPoolExecutor(nrof_workers) if nrof_workers > 1 else None
+    try:
+        while len(summaries) > 1:
+            pairs = list(zip(summaries[::2], summaries[1::2] + [None]))
+            summaries = list(
+                pool.map(merge_pair, pairs) if pool else map(merge_pair, pairs)
+            )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return summaries[0]
@@ -0,0 +1,88 @@
+import json
+import pandas as pd
+
+from pathlib import Path
+from datetime import date
+from dataclasses import dataclass
+
+
+@dataclass
+class WrappedStats:
+    """The numbers of one report period, as made by WrappedMaker.compute.
+
+    All times are in ms. The tables are
+    top_songs: playCount and msPlayed indexed by artistName and trackName, most played first
+    top_artists: playCount and msPlayed indexed by artistName, most played first
+    hours: msPlayed per hour of the day 0 to 23
+    weekdays: msPlayed per weekday 0 (Monday) to 6
+    daily: msPlayed per day from the first to the last day played
+    skip_rates: plays, skips and percent_skipped per song played often enough
+    devices: msPlayed per device
+    skip_rates and devices are None for histories that are not extended.
+    """
+
+    start: date
+    end: date
+    plays: int
+    ms_played: int
+    top_songs: pd.DataFrame
+    top_artists: pd.DataFrame
+    hours: pd.DataFrame
+    weekdays: pd.DataFrame
+    daily: pd.DataFrame
+    skip_rates: pd.DataFrame = None
+    devices: pd.DataFrame = None
+
+    TABLES = (
+        "top_songs",
+        "top_artists",
+        "hours",
+        "weekdays",
+        "daily",
+        "skip_rates",
+        "devices",
+    )
+
+    def summary(self) -> dict:
+        return {
+            "start": self.start.isoformat(),
+            "end": self.end.isoformat(),
+            "plays": self.plays,
+            "ms_played": self.ms_played,
+        }
+
+    def tables(self) -> dict[str, pd.DataFrame]:
+        """The tables that are set, with their index as columns."""
+        return {
+            name: getattr(self, name).reset_index()
+            for name in self.TABLES
+            if getattr(self, name) is not None
+        }
+
+    def to_dict(self) -> dict:
+        """Plain JSON types, each table as a list of row records."""
+        return self.summary() | {
+            name: json.loads(table.to_json(orient="records", date_format="iso"))
+            for name, table in self.tables().items()
+        }
+
+    def to_json(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2, ensure_ascii=False))
+
+    def to_parquet(self, directory: Path) -> None:
+        """Write summary.parquet and one <table>.parquet per table to directory.
+
+        Needs pyarrow (or fastparquet) installed.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame([self.summary()]).to_parquet(directory / "summary.parquet")
+        for name, table in self.tables().items():
+            # Categorical names are stored as plain strings
+            table.astype(
+                {
+                    column: str
+                    for column in table.columns
+                    if isinstance(table[column].dtype, pd.CategoricalDtype)
+                }
+            ).to_parquet(directory / f"{name}.parquet", index=False)
@@ -0,0 +1,216 @@
+import json
+import argparse
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+
+# Platform strings as they appear in extended exports and how often each is used
+PLATFORMS = {
+    "Android OS 12 API 31 (samsung, SM-G991B)": 0.35,
+    "iOS 16.1 (iPhone14,2)": 0.2,
+    "Windows 10 (10.0.19045; x64)": 0.2,
+    "OS X 12.6.1 [arm 2]": 0.1,
+    "Linux [x86-64 0]": 0.05,
+    "Partner sony_ps5 playstation": 0.05,
+    "web_player windows 10;chrome 108.0.0.0;desktop": 0.05,
+}
+
+# Relative amount of listening in each hour of the day
+NIGHT_AND_MORNING = [2, 1, 1, 1, 1, 2, 4, 7, 9, 8, 7, 7]
+AFTERNOON_AND_EVENING = [8, 8, 7, 7, 8, 9, 10, 10, 9, 7, 5, 3]
+HOUR_WEIGHTS = NIGHT_AND_MORNING + AFTERNOON_AND_EVENING
+
+
+def zipf_weights(n: int, exponent: float) -> np.ndarray:
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def synthetic_plays(
+    plays: int,
+    nrof_tracks: int = 20000,
+    nrof_artists: int = 2000,
+    zipf_exponent: float = 1.1,
+    skip_rate: float = 0.25,
+    podcast_rate: float = 0.02,
+    start: datetime = datetime(2015, 1, 1),
+    days: int = 8 * 365,
+    seed: int = 0,
+) -> dict[str, np.ndarray]:
+    """Columns of plays sorted by time, like in a real export.
+
+    Tracks and the artists of the tracks are drawn with Zipf popularity, so a
+    few are played far more than the rest. Skipped plays only last a few
+    seconds, the rest most of the track. Podcast plays have no track or artist.
+    """
+    rng = np.random.default_rng(seed)
+    track_artist = rng.choice(
+        nrof_artists, nrof_tracks, p=zipf_weights(nrof_artists, 1.0)
+    )
+    track_ms = rng.integers(120_000, 360_000, nrof_tracks)
+
+    track = rng.choice(nrof_tracks, plays, p=zipf_weights(nrof_tracks, zipf_exponent))
+    hour = rng.choice(24, plays, p=np.array(HOUR_WEIGHTS) / sum(HOUR_WEIGHTS))
+    seconds = (
+        rng.integers(0, days, plays) * 86400
+        + hour * 3600
+        + rng.integers(0, 3600, plays)
+    )
+    order = np.argsort(seconds, kind="stable")
+    track, seconds = track[order], seconds[order]
+
+    skipped = rng.random(plays) < skip_rate
+    played = np.where(
+        skipped,
+        rng.integers(500, 30_000, plays),
+        (track_ms[track] * rng.uniform(0.8, 1.0, plays)).astype(np.int64),
+    )
+    platform = rng.choice(len(PLATFORMS), plays, p=np.array(list(PLATFORMS.values())))
+    return {
+        "time": np.datetime64(start, "s") + seconds.astype("timedelta64[s]"),
+        "track": track,
+        "artist": track_artist[track],
+        "podcast": rng.random(plays) < podcast_rate,
+        "msPlayed": played,
+        "skipped": skipped,
+        "platform": platform,
+    }
+
+
+def simple_entries(plays: dict, rows: slice) -> list[dict]:
+    return [
+        {
+            "endTime": str(time)[:16].replace("T", " "),
+            "artistName": "Podcast" if podcast else f"Artist {artist}",
+            "trackName": f"Episode {track}" if podcast else f"Track {track}",
+            "msPlayed": int(ms),
+        }
+        for time, artist, track, podcast, ms in zip(
+            plays["time"][rows],
+            plays["artist"][rows],
+            plays["track"][rows],
+            plays["podcast"][rows],
+            plays["msPlayed"][rows],
+        )
+    ]
+
+
+def extended_entries(plays: dict, rows: slice) -> list[dict]:
+    platforms = list(PLATFORMS)
+    entries = []
+    for time, artist, track, podcast, ms, skipped, platform in zip(
+        plays["time"][rows],
+        plays["artist"][rows],
+        plays["track"][rows],
+        plays["podcast"][rows],
+        plays["msPlayed"][rows],
+        plays["skipped"][rows],
+        plays["platform"][rows],
+    ):
+        entries.append(
+            {
+                "ts": f"{str(time)[:19]}Z",
+                "platform": platforms[platform],
+                "ms_played": int(ms),
+                "conn_country": "SE",
+                "ip_addr": "192.0.2.1",
+                "master_metadata_track_name": None if podcast else f"Track {track}",
+                "master_metadata_album_artist_name": (
+                    None if podcast else f"Artist {artist}"
+                ),
+                "master_metadata_album_album_name": (
+                    None if podcast else f"Album {track // 10}"
+                ),
+                "spotify_track_uri": (
+                    None if podcast else f"spotify:track:{track:022d}"
+                ),
+                "episode_name": f"Episode {track}" if podcast else None,
+                "episode_show_name": "Podcast" if podcast else None,
+                "spotify_episode_uri": None,
+                "audiobook_title": None,
+                "audiobook_uri": None,
+                "audiobook_chapter_uri": None,
+                "audiobook_chapter_title": None,
+                "reason_start": "clickrow" if skipped else "trackdone",
+                "reason_end": "fwdbtn" if skipped else "trackdone",
+                "shuffle": False,
+                "skipped": bool(skipped),
+                "offline": False,
+                "offline_timestamp": None,
+                "incognito_mode": False,
+            }
+        )
+    return entries
+
+
+def write_history(
+    directory: Path,
+    plays: int,
+    extended: bool = True,
+    plays_per_file: int = None,
+    **options,
+) -> list[Path]:
+    """Write a synthetic export of plays plays to directory.
+
+    Extended exports are written as Streaming_History_Audio_<years>_N.json,
+    simple ones as StreamingHistory_music_N.json, with plays_per_file plays
+    per file (by default the sizes Spotify uses). options go to
+    synthetic_plays. Returns the files written.
+    """
+    if plays_per_file is None:
+        plays_per_file = 16000 if extended else 10000
+    data = synthetic_plays(plays, **options)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    files = []
+    for index, first in enumerate(range(0, plays, plays_per_file)):
+        rows = slice(first, first + plays_per_file)
+        if extended:
+            years = data["time"][rows].astype("datetime64[Y]").astype(int) + 1970
+            span = (
+                f"{years.min()}"
+                if years.min() == years.max()
+                else f"{years.min()}-{years.max()}"
+            )
+            file_path = directory / f"Streaming_History_Audio_{span}_{index}.json"
+            entries = extended_entries(data, rows)
+        else:
+            file_path = directory / f"StreamingHistory_music_{index}.json"
+            entries = simple_entries(data, rows)
+        with open(file_path, "w", encoding="utf-8") as file:
+            json.dump(entries, file)
+        files.append(file_path)
+    return files
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Write a synthetic Spotify streaming history export"
+    )
+    arg_parser.add_argument("directory", type=Path)
+    arg_parser.add_argument("--plays", type=int, default=100_000)
+    arg_parser.add_argument(
+        "--simple",
+        action="store_true",
+        help="write StreamingHistory_music_N.json files instead of extended ones",
+    )
+    arg_parser.add_argument("--plays-per-file", type=int)
+    arg_parser.add_argument("--tracks", type=int, default=20000)
+    arg_parser.add_argument("--artists", type=int, default=2000)
+    arg_parser.add_argument("--zipf", type=float, default=1.1)
+    arg_parser.add_argument("--skip-rate", type=float, default=0.25)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    files = write_history(
+        args.directory,
+        args.plays,
+        extended=not args.simple,
+        plays_per_file=args.plays_per_file,
+        nrof_tracks=args.tracks,
+        nrof_artists=args.artists,
+        zipf_exponent=args.zipf,
+        skip_rate=args.skip_rate,
+        seed=args.seed,
+    )
+    print(f"Wrote {args.plays} plays to {len(files)} files in {args.directory}")
@@ -1,5 +1,4 @@
-import parser as pr
-from matplotlib.backends.backend_pdf import PdfPages
+import argparse
 from datetime import date
 from pathlib import Path
 
@@ -17,18 +16,57 @@ listening_time_rolling_window = 31
 top_songs_rolling_window = 31
 top_artists_rolling_window = 31
 
-# The pathes to look for streaming history and where to write the finished pdf
+# Most points the lines of one chart draw together, long histories are cut down
+# to it keeping the highest and lowest point of every stretch. None draws every day
+chart_point_budget = 8000
+
+# The pathes to look for streaming history (a folder or the export ZIP) and where to
+# write the finished pdf
 pdf_target_path = Path(".")
 history_src_dir = Path("./Sebbe_streaming_history")
 
-if __name__ == "__main__":
-    wrapp = pr.WrappedMaker(
-        start_date=start_date,
-        end_date=end_date,
-        pdf_target_path=pdf_target_path,
-        history_src_dir=history_src_dir,
-    )
+# Number of processes used to read the history files, 1 reads them in this process
+load_workers = 1
+
+# Number of processes drawing the pages, needs pypdf to merge them when above 1.
+# Each page then carries its own copy of the fonts, so the pdf is larger
+render_workers = 1
+
+# Fonts of the pages, tried in order for every character so names in other
+# scripts (Japanese, ...) still render. Missing fonts are skipped
+font_families = (
+    "Meiryo",
+    "Yu Gothic",
+    "Hiragino Sans",
+    "Noto Sans CJK JP",
+    "IPAexGothic",
+    "DejaVu Sans",
+)
+
+# Where the parsed history is cached between runs, None disables the cache
+history_cache_dir = Path("./history_cache")
 
+# Where drawn pages are kept between runs, a page is only drawn again when its
+# numbers, its settings or the drawing code changed. Needs pypdf, and as with
+# render_workers each page carries its own copy of the fonts, so the pdf is
+# larger. Only the pages of the last run of each pdf are kept. None draws every
+# page
+page_cache_dir = None
+
+# Persistent store that new exports are added to, only plays not seen in earlier
+# exports are parsed and stored. Takes the place of the cache when set
+history_store_dir = None
+
+# Out of core loading for histories larger than memory: the export files are
+# streamed into parts of history_chunk_rows plays in history_chunk_dir, only the
+# plays per day and platform and the names are kept in memory, song, artist and
+# hour totals are read from the parts again when needed. None loads the plays
+# into memory
+history_chunk_dir = None
+history_chunk_rows = 1_000_000
+
+
+def add_report_pages(wrapp: "pr.WrappedMaker") -> None:
     wrapp.front_page()
     wrapp.top_songs()
     wrapp.top_songs_chart()
@@ -41,4 +79,107 @@ if __name__ == "__main__":
     wrapp.play_time_per_weekday()
     wrapp.device_listening_time()
     wrapp.device_listening_chart()
-    wrapp.write_to_file()
\ No newline at end of file
+
+
+def write_report(wrapp: "pr.WrappedMaker") -> None:
+    add_report_pages(wrapp)
+    wrapp.write_to_file()
+
+
+def write_stats(wrapp: "pr.WrappedMaker", stats_format: str, name: str) -> None:
+    """Write the report numbers as <name>.json or a <name>_stats parquet folder."""
+    stats = wrapp.compute()
+    if stats_format == "json":
+        stats.to_json(Path.joinpath(pdf_target_path, f"{name}.json"))
+    else:
+        stats.to_parquet(Path.joinpath(pdf_target_path, f"{name}_stats"))
+
+
+def parse_period(text: str) -> tuple[str, date, date]:
+    start, end = text.split(":")
+    return f"{start}_{end}", date.fromisoformat(start), date.fromisoformat(end)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(
+        description="Make a Spotify Wrapped pdf from a streaming history export"
+    )
+    arg_parser.add_argument(
+        "--per",
+        choices=["year", "quarter"],
+        help="write one Wrapped_<period>.pdf per calendar year or quarter",
+    )
+    arg_parser.add_argument(
+        "--period",
+        action="append",
+        type=parse_period,
+        default=[],
+        metavar="START:END",
+        help="write a Wrapped_START_END.pdf for the days START to END (YYYY-MM-DD), "
+        "can be given several times",
+    )
+    arg_parser.add_argument(
+        "--stats",
+        choices=["json", "parquet"],
+        help="also write the numbers of each report, next to its pdf",
+    )
+    arg_parser.add_argument(
+        "--no-pdf",
+        action="store_true",
+        help="do not draw the pdfs, only useful with --stats",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every stage, written to profile.json and profile.trace.json "
+        "(Chrome trace) next to the pdfs",
+    )
+    args = arg_parser.parse_args()
+
+    # Imported after the arguments are checked, pandas takes a while to import
+    import parser as pr
+    from profiling import Profiler, NO_PROFILER
+
+    profiler = Profiler() if args.profile else NO_PROFILER
+    wrapp = pr.WrappedMaker(
+        start_date=start_date,
+        end_date=end_date,
+        pdf_target_path=pdf_target_path,
+        history_src_dir=history_src_dir,
+        workers=load_workers,
+        cache_dir=history_cache_dir,
+        store_dir=history_store_dir,
+        render_workers=render_workers,
+        font_families=font_families,
+        chunk_dir=history_chunk_dir,
+        chunk_rows=history_chunk_rows,
+        profiler=profiler,
+        page_cache_dir=page_cache_dir,
+        chart_point_budget=chart_point_budget,
+    )
+
+    periods = args.period
+    if args.per is not None:
+        periods += wrapp.split_periods(args.per)
+
+    def write_outputs(name: str) -> None:
+        if args.stats is not None:
+            write_stats(wrapp, args.stats, name)
+        if not args.no_pdf:
+            wrapp.open_pdf(Path.joinpath(pdf_target_path, f"{name}.pdf"))
+            write_report(wrapp)
+
+    if not periods:
+        write_outputs("Wrapped")
+
+    # The history is only loaded once, each period is a slice of it
+    for name, period_start, period_end in periods:
+        wrapp.select_period(period_start, period_end)
+        if wrapp.nrof_plays == 0:
+            print(f"-- WARNING -- \nNo plays in period {name}, it is skipped")
+            continue
+        write_outputs(f"Wrapped_{name}")
+
+    if args.profile:
+        profiler.to_json(Path.joinpath(pdf_target_path, "profile.json"))
+        profiler.to_chrome_trace(Path.joinpath(pdf_target_path, "profile.trace.json"))